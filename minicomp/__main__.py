@@ -0,0 +1,10 @@
+"""python -m minicomp: the interactive emulator or, with a command, headless runs"""
+import os
+import sys
+
+# Modules of minicomp import each other by plain names, as when started by ./go
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from headless import main
+
+sys.exit(main())
@@ -0,0 +1,238 @@
+"""Predecoded basic blocks for faster CPU execution
+
+A basic block here is a straight run of instructions that ends with an
+instruction which may move PC somewhere non-sequential: a branch, a jump, a
+call, a return, an interrupt or KIL. Every instruction in a block is decoded
+once: its operand bytes are read, constant addresses and immediate values are
+resolved and the base cycle count is remembered. Executing a block is then a
+matter of setting PC and calling a handler per instruction, no opcode fetch, no
+operand fetch and no dispatch through addressing mode methods.
+
+Only read-only memory is decoded, RAM is always executed by the CPU the usual
+way. This keeps self-modifying code correct for free and leaves just one way to
+change decoded code: a write to ROM with protection off (that is what `patch`
+does). MMU reports such writes to its rom_write_hooks, and the cache drops every
+block overlapping the written range.
+"""
+from collections import defaultdict, namedtuple
+import sys
+
+
+# Operations after which PC is not guaranteed to point to the next instruction.
+BLOCK_ENDERS = frozenset(("B", "BRK", "JMP", "JSR", "KIL", "RTI", "RTS"))
+# Long blocks are rare, this is just a sanity cap for ROMs filled with NOPs.
+MAX_BLOCK_LEN = 64
+
+# Operand sizes of addressing modes, see CPU._ops.
+OPERAND_SIZE = {
+    "im": 1, "z": 1, "zx": 1, "zy": 1, "ix": 1, "iy": 1,
+    "a": 2, "ax": 2, "ay": 2, "i": 2,
+}
+
+Opcode = namedtuple("Opcode", "op atype mode cc target")
+# entries are (PC after instruction, handler), ends are just those PCs and
+# cycles are running totals of base cycles.
+Block = namedtuple("Block", "start end entries ends cycles")
+
+
+def decode_table(ops):
+    """Turns CPU._ops into a flat list of 256 opcode descriptions
+
+    >>> ops = [("LDA", "v", [("im", 2, [0xa9], None), ("z", 3, [0xa5], None)])]
+    >>> decode_table(ops)[0xa9]
+    Opcode(op='LDA', atype='v', mode='im', cc=2, target=None)
+    >>> decode_table(ops)[0x00] is None
+    True
+    """
+    table = [None]*0x100
+    for op, atype, addrs in ops:
+        for mode, cc, opcodes, target in addrs:
+            for o in opcodes:
+                table[o] = Opcode(op, atype, mode, cc, target)
+    return table
+
+
+class BlockCache:
+    """Decodes and runs basic blocks for a CPU, blocks are keyed by start PC"""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.table = decode_table(cpu._ops)
+        self.mmu = None
+        self.bind()
+
+    def bind(self):
+        """(Re)attaches the cache to the current MMU of the CPU"""
+        self.blocks = {}
+        self.pages = defaultdict(set)  # page -> starts of blocks touching it
+        self.mmu = self.cpu.mmu
+        self.mmu.rom_write_hooks.append(self.invalidate)
+
+    def invalidate(self, lo, hi):
+        """Drops every block which overlaps [lo, hi)"""
+        for page in range(lo >> 8, ((hi - 1) >> 8) + 1):
+            for start in list(self.pages.get(page, ())):
+                block = self.blocks.get(start)
+                if block is None:
+                    self.pages[page].discard(start)
+                elif block.start < hi and lo < block.end:
+                    self.drop(block)
+
+    def drop(self, block):
+        del self.blocks[block.start]
+        for page in range(block.start >> 8, ((block.end - 1) >> 8) + 1):
+            self.pages[page].discard(block.start)
+
+    def clear(self):
+        self.blocks.clear()
+        self.pages.clear()
+
+    def rom_bytes(self, addr):
+        """Returns ROM block contents and an offset of addr in it or None"""
+        try:
+            b = self.mmu.getBlock(addr)
+        except IndexError:
+            return None
+        if not b['readonly'] or addr in self.mmu.ioread:
+            return None
+        return b['memory'], addr - b['start'], b['start'] + b['length']
+
+    def decode(self, pc):
+        """Decodes a block starting at pc, returns None if pc is not in ROM"""
+        found = self.rom_bytes(pc)
+        if found is None:
+            return None
+        mem, ofs, limit = found
+        start, entries, cycles, total = pc, [], [], 0
+        while len(entries) < MAX_BLOCK_LEN:
+            desc = self.table[mem[ofs]]
+            size = self.operand_size(desc)
+            if pc + 1 + size > limit:  # Instruction runs out of the ROM block.
+                break
+            operand = 0
+            for i in range(size):
+                operand += mem[ofs + 1 + i] << (8*i)
+            pc, ofs = pc + 1 + size, ofs + 1 + size
+            entries.append((pc, self.handler(desc, operand)))
+            total += desc.cc
+            cycles.append(total)
+            if desc.op in BLOCK_ENDERS:
+                break
+        if not entries:
+            return None
+        block = Block(start, pc, entries, tuple(e[0] for e in entries), cycles)
+        self.blocks[start] = block
+        for page in range(start >> 8, ((pc - 1) >> 8) + 1):
+            self.pages[page].add(start)
+        return block
+
+    @staticmethod
+    def operand_size(desc):
+        if desc.op == "B":
+            return 1
+        if desc.target:
+            return 0
+        return OPERAND_SIZE.get(desc.mode, 0)
+
+    def handler(self, desc, operand):
+        """Builds a callable which executes a single decoded instruction"""
+        cpu, read = self.cpu, self.mmu.read
+        op_f = getattr(cpu, desc.op)
+        mode = desc.mode
+        if desc.op == "B":
+            target = desc.target
+            return lambda: cpu.branch(target, operand)
+        if desc.target:
+            target = desc.target
+            return lambda: op_f(target)
+        if mode == "im":
+            return lambda: op_f(operand)
+
+        if mode in ("z", "a"):
+            if desc.atype == "v":
+                return lambda: op_f(read(operand))
+            return lambda: op_f(operand)
+
+        resolve = self.resolver(mode, operand)
+        if desc.atype == "v":
+            return lambda: op_f(read(resolve()))
+        return lambda: op_f(resolve())
+
+    def resolver(self, mode, o):
+        """Returns a callable computing an address of a run-time addressing mode
+
+        Mirrors address functions of CPU, including page crossing penalties.
+        """
+        cpu, r, read = self.cpu, self.cpu.r, self.mmu.read
+
+        if mode == "zx":
+            return lambda: (o + r.x) & 0xff
+        if mode == "zy":
+            return lambda: (o + r.y) & 0xff
+        if mode in ("ax", "ay"):
+            reg = mode[1]
+            def indexed():
+                a = o + getattr(r, reg)
+                if o // 0xff != a // 0xff:
+                    cpu.cc += 1
+                return a & 0xffff
+            return indexed
+        if mode == "i":
+            j = o - 0xff if o & 0xff == 0xff else o + 1
+            return lambda: ((read(j) << 8) + read(o)) & 0xffff
+        if mode == "ix":
+            def indexed_indirect():
+                i = (o + r.x) & 0xff
+                return ((read((i + 1) & 0xff) << 8) + read(i)) & 0xffff
+            return indexed_indirect
+        if mode == "iy":
+            def indirect_indexed():
+                base = (read((o + 1) & 0xff) << 8) + read(o)
+                a = base + r.y
+                if base // 0xff != a // 0xff:
+                    cpu.cc += 1
+                return a & 0xffff
+            return indirect_indexed
+        raise ValueError(f"Unknown addressing mode {mode}")
+
+    def run(self, limit, max_cycles=sys.maxsize, until_pc=None):
+        """Executes up to limit instructions, returns (instructions, cycles)
+
+        Also stops when PC becomes until_pc, on KIL and once max_cycles are
+        spent. The latter is checked after every block and may overshoot.
+        """
+        cpu = self.cpu
+        if self.mmu is not cpu.mmu:
+            self.bind()
+        r, blocks, ops = cpu.r, self.blocks, cpu.ops
+        done = cycles = 0
+        try:
+            while done < limit:
+                block = blocks.get(r.pc) or self.decode(r.pc)
+                if block is None:  # Not ROM, do it the usual way.
+                    cpu.cc = 0
+                    ops[cpu.nextByte()](cpu)
+                    cycles += cpu.cc
+                    done += 1
+                else:
+                    entries = block.entries
+                    n = min(len(entries), limit - done)
+                    if until_pc in block.ends:
+                        n = min(n, block.ends.index(until_pc) + 1)
+                    if n < len(entries):
+                        entries = entries[:n]
+                    cpu.cc = 0
+                    k = 0  # Entries done, counts a block cut short by Ctrl-C.
+                    try:
+                        for pc, h in entries:
+                            r.pc = pc
+                            h()
+                            k += 1
+                    finally:
+                        cycles += cpu.cc + (block.cycles[k - 1] if k else 0)
+                        done += k
+                if cycles >= max_cycles or r.pc == until_pc or not cpu.running:
+                    break
+        except KeyboardInterrupt:
+            cpu.interrupted = True
+        return done, cycles
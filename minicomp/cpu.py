@@ -1,11 +1,99 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+from array import array
 import math
-import functools
+import sys
+from collections import namedtuple
+
+from blockcache import BlockCache
+import opgen
+
+
+# Bits of the status register, P is N|V|1|B|D|I|Z|C.
+FLAG_N = 0x80   # N - Negative
+FLAG_V = 0x40   # V - Overflow
+FLAG_B = 0x10   # B - Break Command
+FLAG_D = 0x08   # D - Decimal Mode
+FLAG_I = 0x04   # I - IRQ Disable
+FLAG_Z = 0x02   # Z - Zero
+FLAG_C = 0x01   # C - Carry
+
+FLAG_BITS = {
+    'N': FLAG_N, 'V': FLAG_V, 'B': FLAG_B, 'D': FLAG_D,
+    'I': FLAG_I, 'Z': FLAG_Z, 'C': FLAG_C
+}
+
+# Masks to clear groups of flags before ORing in new values.
+NOT_ZN = 0xff & ~(FLAG_Z | FLAG_N)
+NOT_ZNC = 0xff & ~(FLAG_Z | FLAG_N | FLAG_C)
+NOT_ZNV = 0xff & ~(FLAG_Z | FLAG_N | FLAG_V)
+NOT_ZNCV = 0xff & ~(FLAG_Z | FLAG_N | FLAG_C | FLAG_V)
+
+# Z and N bits for every byte value: Z is set for zero and N is bit 7.
+ZN_FLAGS = bytes((FLAG_Z if v == 0 else 0) | (v & FLAG_N) for v in range(0x100))
+
+
+def buildArithTables():
+    """
+    Precomputes ADC and SBC for every (carry, A, operand) combination.
+
+    Returns three array('H') tables: binary ADC, decimal ADC and decimal SBC.
+    They are indexed with carry << 16 | A << 8 | operand, every entry holds
+    the resulting A in its low byte and the resulting C|V|N|Z bits of P in its
+    high byte. Binary SBC needs no table of its own: it is ADC of the operand
+    with all bits inverted. Decimal results for invalid BCD digits follow the
+    same formulas, whatever they are worth.
+
+    >>> adc_bin, adc_dec, sbc_dec = buildArithTables()
+    >>> e = adc_dec[1 << 16 | 0x19 << 8 | 0x80]  # 19 + 80 + carry in BCD
+    >>> hex(e & 0xff), bool(e >> 8 & FLAG_C)
+    ('0x0', True)
+    >>> e = adc_bin[0x7f << 8 | 0x01]
+    >>> hex(e & 0xff), bool(e >> 8 & FLAG_V), bool(e >> 8 & FLAG_N)
+    ('0x80', True, True)
+    """
+    bcd = [((v & 0xf0) >> 4) * 10 + (v & 0xf) for v in range(0x100)]
+    to_bcd = [(n // 10) * 16 + n % 10 for n in range(100)]
+    adc_bin, adc_dec, sbc_dec = array('H'), array('H'), array('H')
+
+    def entry(a, c, v):
+        return ((ZN_FLAGS[a] | (FLAG_C if c else 0) | (FLAG_V if v else 0)) << 8) | a
+
+    for c in (0, 1):
+        for v1 in range(0x100):
+            d1 = bcd[v1]
+            row = []
+            for v2 in range(0x100):
+                r = v1 + v2 + c
+                row.append(entry(r & 0xff, r > 0xff, ~(v1 ^ v2) & (v1 ^ r) & 0x80))
+            adc_bin.extend(row)
+            row = []
+            for v2 in range(0x100):
+                r = d1 + bcd[v2] + c
+                row.append(entry(to_bcd[r % 100], r > 99, ~(v1 ^ v2) & (v1 ^ r) & 0x80))
+            adc_dec.extend(row)
+            row = []
+            for v2 in range(0x100):
+                r = d1 - bcd[v2] - (1 - c)
+                row.append(entry(to_bcd[r % 100], r >= 0, (v1 ^ v2) & (v1 ^ r) & 0x80))
+            sbc_dec.extend(row)
+    return adc_bin, adc_dec, sbc_dec
 
 
 class Registers:
-    """ An object to hold the CPU registers. """
+    """ An object to hold the CPU registers.
+
+    Flags live in `p` and operations update it with masks and ZN_FLAGS. The
+    string based flag methods are kept for everybody else:
+    >>> r = Registers()
+    >>> r.ZN(0x80)
+    >>> r.getFlag('N'), r.getFlag('Z')
+    (True, False)
+    >>> r.setFlag('C'); r.clearFlag('N'); bin(r.p)
+    '0b100101'
+    """
+    flagBit = FLAG_BITS
+
     def __init__(self, pc=0):
         self.reset(pc)
 
@@ -15,29 +103,19 @@ class Registers:
         self.y = 0          # General Purpose Y
         self.s = 0xff       # Stack Pointer
         self.pc = pc        # Program Counter
-
-        self.flagBit = {
-            'N': 128,   # N - Negative
-            'V': 64,    # V - Overflow
-            'B': 16,    # B - Break Command
-            'D': 8,     # D - Decimal Mode
-            'I': 4,     # I - IRQ Disable
-            'Z': 2,     # Z - Zero
-            'C': 1      # C - Carry
-        }
         self.p = 0b00100100  # Flag Pointer - N|V|1|B|D|I|Z|C
 
     def getFlag(self, flag):
-        return bool(self.p & self.flagBit[flag])
+        return bool(self.p & FLAG_BITS[flag])
 
     def setFlag(self, flag, v=True):
         if v:
-            self.p = self.p | self.flagBit[flag]
+            self.p = self.p | FLAG_BITS[flag]
         else:
             self.clearFlag(flag)
 
     def clearFlag(self, flag):
-        self.p = self.p & (255 - self.flagBit[flag])
+        self.p = self.p & (255 - FLAG_BITS[flag])
 
     def clearFlags(self):
         self.p = 0
@@ -47,8 +125,7 @@ class Registers:
         The criteria for Z and N flags are standard.  Z gets set if the
         value is zero and N gets set to the same value as bit 7 of the value.
         """
-        self.setFlag('Z', v == 0)
-        self.setFlag('N', v & 0x80)
+        self.p = (self.p & NOT_ZN) | ZN_FLAGS[v & 0xff]
 
     def __repr__(self):
         return "A: %02x X: %02x Y: %02x S: %02x PC: %04x P: %s" % (
@@ -56,9 +133,33 @@ class Registers:
         )
 
 
+# Why CPU.run() has stopped, see its docstring.
+STOP_INSTRUCTIONS = "instructions"
+STOP_CYCLES = "cycles"
+STOP_PC = "pc"
+STOP_HALTED = "halted"
+STOP_INTERRUPTED = "interrupted"
+STOP_BREAK = "break"
+STOP_WATCH = "watch"
+
+RunResult = namedtuple("RunResult", "reason instructions cycles")
+
+# Observer granularities, see `CPU.subscribe`. A number means every that many
+# cycles.
+EVERY_INSTRUCTION = "instruction"
+END_OF_RUN = "end"
+
+RegisterState = namedtuple("RegisterState", "a x y s pc p")
+# CPU state saved by CPU.snapshot(), memory is a tuple of mmu.BlockState.
+Snapshot = namedtuple("Snapshot", "r cc instructions cycles running memory")
+
+
 class CPU:
+    # ADC/SBC lookup tables, see `buildArithTables`. They are built on the
+    # first CPU creation and shared by all instances.
+    adcBinary = adcDecimal = sbcDecimal = None
 
-    def __init__(self, mmu=None, pc=None, stack_page=0x1, magic=0xee, observer=None):
+    def __init__(self, mmu=None, pc=None, stack_page=0x1, magic=0xee):
         """
         Parameters
         ----------
@@ -70,16 +171,40 @@ class CPU:
         magic: A value needed for the illegal opcodes, XAA.  This value differs
             between different versions, even of the same CPU.  The default is 0xee.
         """
-        self.observer = observer  # to register stats monitors
+        if CPU.adcBinary is None:
+            CPU.adcBinary, CPU.adcDecimal, CPU.sbcDecimal = buildArithTables()
         self.mmu = mmu
         self.r = Registers()
         # Hold the number of CPU cycles used during the last call to `self.step()`
         self.cc = 0
+        # Totals since creation or `reset`, kept up to date by `run`.
+        self.instructions = 0
+        self.cycles = 0
+        # Callbacks by granularity, see `subscribe`.
+        self.observers = {EVERY_INSTRUCTION: [], END_OF_RUN: []}
+        self.cycleObservers = []  # [callback, cycles]
         # Which page the stack is in.  0x1 means that the stack is from
         # 0x100-0x1ff.  In the 6502 this is always true but it's different
         # for other 65* varients.
         self.stack_page = stack_page
         self.magic = magic
+        # Optional execution engine with predecoded basic blocks, see
+        # `useBlockCache`.
+        self.blockcache = None
+        # Optional tracer.Tracer and profiler.Profiler, while one of them is
+        # attached it executes instructions instead of the usual loop. Tracer
+        # takes precedence if both are.
+        self.tracer = None
+        self.profiler = None
+        # KIL clears `running`, Ctrl-C during `run` sets `interrupted`.
+        self.running = True
+        self.interrupted = False
+        # Debugging: PCs to stop at and watched addresses with "r" or "w".
+        # A watched access clears `running` too and leaves (addr, direction)
+        # in `watchhit`.
+        self.breakpoints = set()
+        self.watchpoints = {}
+        self.watchhit = None
 
         if pc:
             self.r.pc = pc
@@ -94,13 +219,175 @@ class CPU:
         self.mmu.reset()
 
         self.running = True
+        self.instructions = self.cycles = 0
 
-    def step(self, refresh=False):
-        self.cc = 0
-        opcode = self.nextByte()
-        self.ops[opcode]()
-        if self.observer is not None:
-            self.observer.update_stats(self, refresh)
+    def subscribe(self, callback, every=END_OF_RUN):
+        """Has `run` call callback(cpu) at the chosen granularity
+
+        every is EVERY_INSTRUCTION, END_OF_RUN or a number of cycles. Cycle
+        observers are called once the `cycles` total crosses a multiple of
+        their number, a run stops for them as often as needed, blocks of the
+        block cache may overshoot.
+        """
+        if every in self.observers:
+            self.observers[every].append(callback)
+        else:
+            self.cycleObservers.append([callback, every])
+
+    def unsubscribe(self, callback):
+        for observers in self.observers.values():
+            while callback in observers:
+                observers.remove(callback)
+        self.cycleObservers = [o for o in self.cycleObservers if o[0] != callback]
+
+    def snapshot(self):
+        """Returns registers, counters and memory contents as an immutable Snapshot"""
+        r = self.r
+        return Snapshot(RegisterState(r.a, r.x, r.y, r.s, r.pc, r.p), self.cc,
+                        self.instructions, self.cycles, self.running, self.mmu.snapshot())
+
+    def restore(self, snap):
+        """Brings the CPU and its memory back to the state saved by `snapshot`"""
+        self.mmu.restore(snap.memory)
+        self.r.a, self.r.x, self.r.y, self.r.s, self.r.pc, self.r.p = snap.r
+        self.cc, self.running = snap.cc, snap.running
+        self.instructions, self.cycles = snap.instructions, snap.cycles
+
+    def step(self):
+        """Executes a single instruction, see `run`"""
+        return self.run(max_instructions=1)
+
+    def useBlockCache(self, enable=True):
+        """Switches the predecoded basic blocks engine on or off"""
+        self.blockcache = BlockCache(self) if enable else None
+
+    def run(self, max_instructions=None, max_cycles=None, until_pc=None):
+        """
+        Execute instructions until a budget is exhausted, PC reaches
+        `until_pc` or a breakpoint, a watched address is accessed, KIL halts
+        the CPU or the user hits Ctrl-C.
+
+        Parameters
+        ----------
+        max_instructions: Stop after this many instructions (default no limit)
+        max_cycles: Stop once at least this many cycles are spent. The last
+            instruction (the last block with the block cache) may overshoot.
+        until_pc: Stop as soon as PC gets this value.
+
+        Observers are notified as they asked in `subscribe`, with nobody
+        subscribed to every instruction or a number of cycles the whole run
+        is a single call of an execution loop.
+
+        Returns RunResult(reason, instructions, cycles), reason is one of
+        STOP_* values.
+        """
+        max_instructions = sys.maxsize if max_instructions is None else max_instructions
+        max_cycles = sys.maxsize if max_cycles is None else max_cycles
+        chunk = 1 if self.observers[EVERY_INSTRUCTION] else sys.maxsize
+        self.running, self.interrupted, self.watchhit = True, False, None
+        # Watchpoints clear `running` which every loop checks anyway, but the
+        # block cache does so only at block ends. Breakpoints need a PC check
+        # after every instruction. While debugging a loop doing exactly that
+        # replaces both usual loops, they stay free of any extra checks.
+        stops = self.breakpoints | {until_pc} if until_pc is not None else self.breakpoints
+        debugging = self.breakpoints or self.watchpoints
+        done = cycles = 0
+        while True:
+            limit = min(chunk, max_instructions - done)
+            # Stop right after the next multiple of any cycle observer's number.
+            budget = min((every - self.cycles % every for _, every in self.cycleObservers),
+                         default=sys.maxsize)
+            budget = min(budget, max_cycles - cycles)
+            if self.tracer is not None:
+                n, c = self.tracer.run(self, limit, budget, stops)
+            elif self.profiler is not None:
+                n, c = self.profiler.run(self, limit, budget, stops)
+            elif debugging:
+                n, c = self._runBreak(limit, budget, stops)
+            elif self.blockcache is None:
+                n, c = self._runSteps(limit, budget, until_pc)
+            else:
+                n, c = self.blockcache.run(limit, budget, until_pc)
+            done, cycles = done + n, cycles + c
+            self.instructions += n
+            self.cycles += c
+            if self.interrupted:
+                reason = STOP_INTERRUPTED
+            elif self.watchhit is not None:
+                reason = STOP_WATCH
+                self.running = True
+            elif not self.running:
+                reason = STOP_HALTED
+            elif self.r.pc == until_pc:
+                reason = STOP_PC
+            elif self.r.pc in self.breakpoints:
+                reason = STOP_BREAK
+            elif cycles >= max_cycles:
+                reason = STOP_CYCLES
+            elif done >= max_instructions:
+                reason = STOP_INSTRUCTIONS
+            else:
+                reason = None
+            for callback in self.observers[EVERY_INSTRUCTION]:
+                callback(self)
+            for callback, every in self.cycleObservers:
+                if self.cycles // every != (self.cycles - c) // every:
+                    callback(self)
+            if reason is not None:
+                for callback in self.observers[END_OF_RUN]:
+                    callback(self)
+                return RunResult(reason, done, cycles)
+
+    def _runSteps(self, limit, max_cycles, until_pc):
+        """The tight loop behind `run`, returns (instructions, cycles)"""
+        r, ops, read = self.r, self.ops, self.mmu.read
+        done = cycles = 0
+        try:
+            while done < limit:
+                self.cc = 0
+                opcode = read(r.pc)
+                r.pc += 1
+                ops[opcode](self)
+                cycles += self.cc
+                done += 1
+                if cycles >= max_cycles or r.pc == until_pc or not self.running:
+                    break
+        except KeyboardInterrupt:
+            self.interrupted = True
+        return done, cycles
+
+    def _runBreak(self, limit, max_cycles, stops):
+        """`_runSteps` which stops at any PC in stops"""
+        r, ops, read = self.r, self.ops, self.mmu.read
+        done = cycles = 0
+        try:
+            while done < limit:
+                self.cc = 0
+                opcode = read(r.pc)
+                r.pc += 1
+                ops[opcode](self)
+                cycles += self.cc
+                done += 1
+                if cycles >= max_cycles or r.pc in stops or not self.running:
+                    break
+        except KeyboardInterrupt:
+            self.interrupted = True
+        return done, cycles
+
+    def addWatchpoint(self, addr, direction="w"):
+        """Stops `run` after an instruction reads ("r") or writes ("w") addr"""
+        self.deleteWatchpoint(addr)
+        self.watchpoints[addr] = direction
+        self.mmu.watch(addr, direction, self._watchHit)
+
+    def deleteWatchpoint(self, addr):
+        direction = self.watchpoints.pop(addr, None)
+        if direction is not None:
+            self.mmu.unwatch(addr, direction)
+
+    def _watchHit(self, addr, direction):
+        self.watchhit = (addr, direction)
+        self.running = False
 
     def execute(self, instruction):
         """
@@ -588,54 +875,22 @@ class CPU:
     ]
 
     def _create_ops(self):
-
-        def f(self, op_f, a_f, cc):
-            op_f(a_f())
-            self.cc += cc
-
-        def f_target(target):
-            return target
-
-        self.ops = [None]*0x100
-
-        for op, atype, addrs in self._ops:
-            op_f = getattr(self, op)
-            for a, cc, opcode, target in addrs:
-                if target:
-                    a_f = functools.partial(f_target, target)
-                elif atype == 'v':
-                    a_f = getattr(self, a)
-                else:
-                    a_f = getattr(self, "%s_a" % a)
-
-                fp = functools.partial(f, self, op_f, a_f, cc)
-                for o in opcode:
-                    if self.ops[o]:
-                        raise Exception("Opcode %s already defined" % hex(o))
-                    self.ops[o] = fp
+        # Handlers are generated from _ops once per process (and cached on
+        # disk), they take the CPU as an argument: self.ops[opcode](self).
+        self.ops = opgen.handlers(self._ops)
 
     def ADC(self, v2):
-        v1 = self.r.a
-
-        if self.r.getFlag('D'):  # decimal mode
-            d1 = self.fromBCD(v1)
-            d2 = self.fromBCD(v2)
-            r = d1 + d2 + self.r.getFlag('C')
-            self.r.a = self.toBCD(r % 100)
-
-            self.r.setFlag('C', r > 99)
-        else:
-            r = v1 + v2 + self.r.getFlag('C')
-            self.r.a = r & 0xff
-
-            self.r.setFlag('C', r > 0xff)
-
-        self.r.ZN(self.r.a)
-        self.r.setFlag('V', ((~(v1 ^ v2)) & (v1 ^ r) & 0x80))
+        r = self.r
+        p = r.p
+        table = self.adcDecimal if p & FLAG_D else self.adcBinary
+        e = table[(p & FLAG_C) << 16 | (r.a & 0xff) << 8 | (v2 & 0xff)]
+        r.a = e & 0xff
+        r.p = (p & NOT_ZNCV) | (e >> 8)
 
     def AND(self, v):
-        self.r.a = (self.r.a & v) & 0xff
-        self.r.ZN(self.r.a)
+        r = self.r
+        r.a = a = (r.a & v) & 0xff
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[a]
 
     def ASL(self, a):
         if a == 'a':
@@ -645,40 +900,41 @@ class CPU:
             v = self.mmu.read(a) << 1
             self.mmu.write(a, v)
 
-        self.r.setFlag('C', v > 0xff)
-        self.r.ZN(v & 0xff)
+        # v is at most 0x1fe, bit 8 goes straight to C.
+        self.r.p = (self.r.p & NOT_ZNC) | ZN_FLAGS[v & 0xff] | (v >> 8)
 
     def BIT(self, v):
-        self.r.setFlag('Z', self.r.a & v == 0)
-        self.r.setFlag('N', v & 0x80)
-        self.r.setFlag('V', v & 0x40)
+        z = FLAG_Z if self.r.a & v == 0 else 0
+        self.r.p = (self.r.p & NOT_ZNV) | (v & (FLAG_N | FLAG_V)) | z
 
     def B(self, v):
         """
         v is a tuple of (flag, boolean).  For instance, BCC (Branch Carry Clear)
         will call B(('C', False)).
         """
-        d = self.im()
-        if self.r.getFlag(v[0]) is v[1]:
+        self.branch(v, self.im())
+
+    def branch(self, v, d):
+        """Branch by the offset d if the condition v holds."""
+        flag, expected = v
+        if bool(self.r.p & FLAG_BITS[flag]) is expected:
             o = self.r.pc
             self.r.pc += self.fromTwosCom(d)
-            if math.floor(o/0xff) == math.floor(self.r.pc/0xff):
+            if o // 0xff == self.r.pc // 0xff:
                 self.cc += 1
             else:
                 self.cc += 2
 
     def BRK(self, _):
-        self.r.setFlag('B')
+        self.r.p |= FLAG_B
         self.stackPushWord(self.r.pc+1)
         self.stackPush(self.r.p)
-        self.r.setFlag('I')
+        self.r.p |= FLAG_I
         self.r.pc = self.interruptAddress('BRK')
 
     def CP(self, r, v):
         o = (r-v) & 0xff
-        self.r.setFlag('Z', o == 0)
-        self.r.setFlag('C', v <= r)
-        self.r.setFlag('N', o & 0x80)
+        self.r.p = (self.r.p & NOT_ZNC) | ZN_FLAGS[o] | (FLAG_C if v <= r else 0)
 
     def CMP(self, v):
         self.CP(self.r.a, v)
@@ -692,41 +948,46 @@ class CPU:
     def DEC(self, a):
         v = (self.mmu.read(a)-1) & 0xff
         self.mmu.write(a, v)
-        self.r.ZN(v)
+        self.r.p = (self.r.p & NOT_ZN) | ZN_FLAGS[v]
 
     def DEX(self, _):
-        self.r.x = (self.r.x-1) & 0xff
-        self.r.ZN(self.r.x)
+        r = self.r
+        r.x = x = (r.x-1) & 0xff
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[x]
 
     def DEY(self, _):
-        self.r.y = (self.r.y-1) & 0xff
-        self.r.ZN(self.r.y)
+        r = self.r
+        r.y = y = (r.y-1) & 0xff
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[y]
 
     def EOR(self, v):
-        self.r.a = self.r.a ^ v
-        self.r.ZN(self.r.a)
+        r = self.r
+        r.a = a = r.a ^ v
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[a & 0xff]
 
     """Flag Instructions."""
     def SE(self, v):
         """Set the flag to True."""
-        self.r.setFlag(v)
+        self.r.p |= FLAG_BITS[v]
 
     def CL(self, v):
         """Clear the flag to False."""
-        self.r.clearFlag(v)
+        self.r.p &= 0xff ^ FLAG_BITS[v]
 
     def INC(self, a):
         v = (self.mmu.read(a)+1) & 0xff
         self.mmu.write(a, v)
-        self.r.ZN(v)
+        self.r.p = (self.r.p & NOT_ZN) | ZN_FLAGS[v]
 
     def INX(self, _):
-        self.r.x = (self.r.x+1) & 0xff
-        self.r.ZN(self.r.x)
+        r = self.r
+        r.x = x = (r.x+1) & 0xff
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[x]
 
     def INY(self, _):
-        self.r.y = (self.r.y+1) & 0xff
-        self.r.ZN(self.r.y)
+        r = self.r
+        r.y = y = (r.y+1) & 0xff
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[y]
 
     def JMP(self, a):
         self.r.pc = a
@@ -736,35 +997,38 @@ class CPU:
         self.r.pc = a
 
     def LDA(self, v):
-        self.r.a = v
-        self.r.ZN(self.r.a)
+        r = self.r
+        r.a = v
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[v & 0xff]
 
     def LDX(self, v):
-        self.r.x = v
-        self.r.ZN(self.r.x)
+        r = self.r
+        r.x = v
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[v & 0xff]
 
     def LDY(self, v):
-        self.r.y = v
-        self.r.ZN(self.r.y)
+        r = self.r
+        r.y = v
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[v & 0xff]
 
     def LSR(self, a):
         if a == 'a':
-            self.r.setFlag('C', self.r.a & 0x01)
-            self.r.a = v = self.r.a >> 1
+            old = self.r.a
+            self.r.a = v = old >> 1
         else:
-            v = self.mmu.read(a)
-            self.r.setFlag('C', v & 0x01)
-            v = v >> 1
+            old = self.mmu.read(a)
+            v = old >> 1
             self.mmu.write(a, v)
 
-        self.r.ZN(v)
+        self.r.p = (self.r.p & NOT_ZNC) | ZN_FLAGS[v & 0xff] | (old & FLAG_C)
 
     def NOP(self, _):
         pass
 
     def ORA(self, v):
-        self.r.a = self.r.a | v
-        self.r.ZN(self.r.a)
+        r = self.r
+        r.a = a = r.a | v
+        r.p = (r.p & NOT_ZN) | ZN_FLAGS[a & 0xff]
 
     def P(self, v):
         """
@@ -781,33 +1045,33 @@ class CPU:
             setattr(self.r, r, self.stackPop())
 
             if r == "a":
-                self.r.ZN(self.r.a)
+                self.r.p = (self.r.p & NOT_ZN) | ZN_FLAGS[self.r.a]
             elif r == "p":
                 self.r.p = self.r.p | 0b00100000
 
     def ROL(self, a):
+        c = self.r.p & FLAG_C
         if a == "a":
             v_old = self.r.a
-            self.r.a = v_new = ((v_old << 1) + self.r.getFlag('C')) & 0xff
+            self.r.a = v_new = ((v_old << 1) + c) & 0xff
         else:
             v_old = self.mmu.read(a)
-            v_new = ((v_old << 1) + self.r.getFlag('C')) & 0xff
+            v_new = ((v_old << 1) + c) & 0xff
             self.mmu.write(a, v_new)
 
-        self.r.setFlag('C', v_old & 0x80)
-        self.r.ZN(v_new)
+        self.r.p = (self.r.p & NOT_ZNC) | ZN_FLAGS[v_new] | ((v_old >> 7) & FLAG_C)
 
     def ROR(self, a):
+        c = self.r.p & FLAG_C
         if a == "a":
             v_old = self.r.a
-            self.r.a = v_new = ((v_old >> 1) + self.r.getFlag('C')*0x80) & 0xff
+            self.r.a = v_new = ((v_old >> 1) + c*0x80) & 0xff
         else:
             v_old = self.mmu.read(a)
-            v_new = ((v_old >> 1) + self.r.getFlag('C')*0x80) & 0xff
+            v_new = ((v_old >> 1) + c*0x80) & 0xff
             self.mmu.write(a, v_new)
 
-        self.r.setFlag('C', v_old & 0x01)
-        self.r.ZN(v_new)
+        self.r.p = (self.r.p & NOT_ZNC) | ZN_FLAGS[v_new] | (v_old & FLAG_C)
 
     def RTI(self, _):
         self.r.p = self.stackPop()
@@ -817,19 +1081,14 @@ class CPU:
         self.r.pc = (self.stackPopWord() + 1) & 0xffff
 
     def SBC(self, v2):
-        v1 = self.r.a
-        if self.r.getFlag('D'):
-            d1 = self.fromBCD(v1)
-            d2 = self.fromBCD(v2)
-            r = d1 - d2 - (not self.r.getFlag('C'))
-            self.r.a = self.toBCD(r % 100)
-        else:
-            r = v1 - v2 - (not self.r.getFlag('C'))
-            self.r.a = r & 0xff
-
-        self.r.setFlag('C', r >= 0)
-        self.r.setFlag('V', ((v1 ^ v2) & (v1 ^ r) & 0x80))
-        self.r.ZN(self.r.a)
+        r = self.r
+        p = r.p
+        if p & FLAG_D:
+            e = self.sbcDecimal[(p & FLAG_C) << 16 | (r.a & 0xff) << 8 | (v2 & 0xff)]
+        else:  # A - M - (1 - C) == A + ~M + C
+            e = self.adcBinary[(p & FLAG_C) << 16 | (r.a & 0xff) << 8 | (~v2 & 0xff)]
+        r.a = e & 0xff
+        r.p = (p & NOT_ZNCV) | (e >> 8)
 
     def STA(self, a):
         self.mmu.write(a, self.r.a)
@@ -847,9 +1106,10 @@ class CPU:
         would be T(('a', 'x'))self.
         """
         s, d = a
-        setattr(self.r, d, getattr(self.r, s))
+        v = getattr(self.r, s)
+        setattr(self.r, d, v)
         if d != 's':
-            self.r.ZN(getattr(self.r, d))
+            self.r.p = (self.r.p & NOT_ZN) | ZN_FLAGS[v & 0xff]
 
     """
     Illegal Opcodes
@@ -871,7 +1131,7 @@ class CPU:
 
     def AAC(self, v):  # ANC
         self.AND(v)
-        self.r.setFlag('C', self.r.getFlag('N'))
+        self.r.p = (self.r.p & (0xff ^ FLAG_C)) | (self.r.p >> 7)
 
     def AAX(self, a):  # SAX, AXS
         r = self.r.a & self.r.x
@@ -881,8 +1141,10 @@ class CPU:
     def ARR(self, v):
         self.AND(v)
         self.ROR('a')
-        self.r.setFlag('C', self.r.a & 0x40)
-        self.r.setFlag('V', bool(self.r.a & 0x40) ^ bool(self.r.a & 0x20))
+        a = self.r.a
+        c = FLAG_C if a & 0x40 else 0
+        v = FLAG_V if bool(a & 0x40) ^ bool(a & 0x20) else 0
+        self.r.p = (self.r.p & (0xff ^ (FLAG_C | FLAG_V))) | c | v
 
     def ASR(self, v):  # ALR
         self.AND(v)
@@ -915,10 +1177,8 @@ class CPU:
 
     def AXS(self, v):  # SBX, SAX
         o = self.r.a & self.r.x
-        self.r.x = (o - v) & 0xff
-
-        self.r.setFlag('C', v <= o)
-        self.r.ZN(self.r.x)
+        self.r.x = x = (o - v) & 0xff
+        self.r.p = (self.r.p & NOT_ZNC) | ZN_FLAGS[x] | (FLAG_C if v <= o else 0)
 
     def DCP(self, a):  # DCM
         self.DEC(a)
@@ -932,12 +1192,12 @@ class CPU:
         self.running = False
 
     def LAR(self, v):  # LAE, LAS
-        self.r.a = self.r.x = self.r.s = self.r.s & v
-        self.r.ZN(self.r.a)
+        self.r.a = self.r.x = self.r.s = a = self.r.s & v
+        self.r.p = (self.r.p & NOT_ZN) | ZN_FLAGS[a]
 
     def LAX(self, v):
         self.r.a = self.r.x = v
-        self.r.ZN(self.r.a)
+        self.r.p = (self.r.p & NOT_ZN) | ZN_FLAGS[v & 0xff]
 
     def RLA(self, a):
         self.ROL(a)
@@ -988,8 +1248,8 @@ class CPU:
         "magic" varies by version of the processor.  0xee seems to be common.
         The formula is: A = (A | magic) & X & imm
         """
-        self.r.a = (self.r.a | self.magic) & self.r.x & v
-        self.r.ZN(self.r.a)
+        self.r.a = a = (self.r.a | self.magic) & self.r.x & v
+        self.r.p = (self.r.p & NOT_ZN) | ZN_FLAGS[a & 0xff]
 
     def XAS(self, a):  # SHS, TAS
         # First set the stack pointer's value
@@ -82,6 +82,36 @@ def funargs(func):
 # -- End prediactes for missing_args -----------------
 
 
+def condition_env(func):
+    """Returns a function turning call arguments of func into a dict by name
+
+    The signature is inspected once, here. Arguments which were not passed get
+    their default values.
+
+    >>> env = condition_env(lambda x, y=2, z=3: None)
+    >>> env((1,), {"z": 4})
+    {'y': 2, 'z': 4, 'x': 1}
+    """
+    names = [arg.name for arg in funargs(func)]
+    defaults = dict((arg.name, arg.default) for arg in filter(arg_has_default_value, funargs(func)))
+    def env(a, k):
+        result = dict(defaults)
+        # Zipping this way is safe since positional arguments cannot follow
+        # named arguments.
+        result.update(zip(names, a))
+        if k:  # Could also get some keyword arguments.
+            result.update(k)
+        return result
+    return env
+
+
+def compile_condition(condition):
+    """Returns a code object for a condition string, None if it is not a string"""
+    if not isinstance(condition, str):
+        return None
+    return compile(condition, f"<condition {condition}>", "eval")
+
+
 def missing_args(msg):
     def decorator(f):
         need_num_args = len(list(takewhile(arg_lacks_default_value, funargs(f))))
@@ -252,28 +282,20 @@ def precondition(condition, error_msg):
         True
 
         """
+    code = compile_condition(condition)
     def decorator(f):
+        # utils needs this module to be loaded, so it is imported when
+        # decorating rather than at the top.
+        from utils import file_accessible
+        make_env = condition_env(f)
         @wraps(f)
         def wrapper(*a, **k):
-            # Zipping this way is safe since positional arguments cannot follow
-            # named arguments.
-            from utils import file_accessible
-            supplied_args = dict(zip([arg.name for arg in funargs(f)], a))
-            # Could also get some keyword arguments.
-            supplied_args.update(k)
-            # Environment must contain default arguments in case something was not passed
-            env = dict((arg.name, arg.default)
-                       for arg in filter(arg_has_default_value, funargs(f))
-                       if arg.name not in supplied_args)
-            # ...and also everything that was passed.
-            env.update(supplied_args)
-            env["file_accessible"] = file_accessible
-            if isinstance(condition, str):
-                result = eval(condition, env)
-            else:
+            if code is None:
                 return ("IE: this call caused core meltdown. Please record it and pass to "
                         "the maintainer.")
-            if result:
+            env = make_env(a, k)
+            env["file_accessible"] = file_accessible
+            if eval(code, env):
                 return f(*a, **k)
             return error_msg
         # TODO: make them all belong to stackable class?
@@ -285,25 +307,15 @@ def precondition(condition, error_msg):
 def strict_precond(condition, exception, emsg):
     """Checks internal integrity and raises if a function is passed wrong argument
     """
+    code = compile_condition(condition)
     def decorator(f):
+        make_env = condition_env(f)
         @wraps(f)
         def wrapper(*a, **k):
-            # Zipping this way is safe since positional arguments cannot follow
-            # named arguments.
-            supplied_args = dict(zip([arg.name for arg in funargs(f)], a))
-            # Could also get some keyword arguments.
-            supplied_args.update(k)
-            # Environment must contain default arguments in case something was not passed
-            env = dict((arg.name, arg.default)
-                       for arg in filter(arg_has_default_value, funargs(f))
-                       if arg.name not in supplied_args)
-            # ...and also everything that was passed.
-            env.update(supplied_args)
-            if isinstance(condition, str):
-                result = eval(condition, env)
-            else:
+            if code is None:
                 return ("IE: core meltdown. Please report circumstances to the maintainer.")
-            if result:
+            env = make_env(a, k)
+            if eval(code, env):
                 return f(*a, **k)
             raise exception(emsg.format(**env))
         # TODO: make them all belong to stackable class?
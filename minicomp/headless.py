@@ -0,0 +1,216 @@
+"""Runs ROMs without a terminal
+
+    python -m minicomp run ROM [--input FILE] [--cycles N] [--screen-out FILE]
+
+    python -m minicomp batch MANIFEST [--jobs N]
+
+Keyboard input is taken from a file, everything the ROM writes to the screen
+is saved to a file and a summary of the run is printed to stdout. Nothing here
+imports curses, so runs work in CI and over pipes.
+
+A batch manifest has a JSON object per line:
+
+    {"rom": "echo.bin", "input": "in.txt", "cycles": 20000, "expected": "out.txt"}
+
+"rom" and a budget are required, "instructions" is a budget too, file names
+are relative to the manifest. Jobs are spread over a pool of processes and a JSON line with
+the outcome is printed as soon as a job is done, so results come out of order.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import sys
+
+from cpu import CPU, STOP_INTERRUPTED
+from machine import BASEADDR, build_computer
+from mmu import FlatMMU, Keyboard, RAM
+from profiler import Profiler
+from tracer import Tracer
+
+
+def run_rom(fname, inpt=b"", max_cycles=None, max_instructions=None,
+            until_pc=None, blockcache=True, trace=None, profile=None, input_file=None):
+    """Runs ROM from fname with inpt typed in, returns (RunResult, screen bytes)
+
+    Contents of input_file (a FIFO works too) are typed in after inpt, read
+    as the ROM consumes them.
+
+    Every executed instruction is recorded to trace file if it is given,
+    collapsed call stacks are saved to profile file if that is given.
+
+    >>> import os
+    >>> rom = os.path.join(os.path.dirname(__file__), "empty.bin")
+    >>> result, screen = run_rom(rom, max_instructions=10)
+    >>> result.reason, result.instructions, screen
+    ('instructions', 10, b'')
+    """
+    screen = bytearray()
+    kbd = Keyboard(inpt)
+    if input_file is not None:
+        kbd.stream(input_file)
+    c = build_computer(fname, lambda value: screen.append(value & 0xff), kbd)
+    c.useBlockCache(blockcache)
+    if trace is not None:
+        c.tracer = Tracer(fname=trace)
+    if profile is not None:
+        c.profiler = Profiler()
+    try:
+        return c.run(max_instructions=max_instructions, max_cycles=max_cycles,
+                     until_pc=until_pc), bytes(screen)
+    finally:
+        kbd.clear()
+        if c.tracer is not None:
+            c.tracer.close()
+        if c.profiler is not None:
+            with open(profile, "w") as f:
+                f.writelines(line + "\n" for line in c.profiler.collapsed())
+
+
+# Machines of a batch worker process by ROM file name: (cpu, screen, keyboard),
+# least recently used first. Only the last few ROMs are kept.
+_machines = {}
+MAX_MACHINES = 8
+
+
+def warm_up():
+    """Batch worker initializer: builds tables shared by all CPUs in a process"""
+    CPU(FlatMMU(RAM(0x00, 0x100)))
+
+
+def read_manifest(fname):
+    """Yields jobs of a manifest with file names resolved and line numbers set
+
+    Raises ValueError naming the line for a job which is not a JSON object
+    with "rom" and a budget, a job without one could run forever.
+    """
+    base = os.path.dirname(os.path.abspath(fname))
+    with open(fname) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{fname}:{n}: {e}") from None
+            if not isinstance(job, dict) or "rom" not in job:
+                raise ValueError(f"{fname}:{n}: job has no rom")
+            if "cycles" not in job and "instructions" not in job:
+                raise ValueError(f"{fname}:{n}: job has no cycles or instructions budget")
+            for key in ("rom", "input", "expected"):
+                if key in job:
+                    job[key] = os.path.join(base, job[key])
+            job["line"] = n
+            yield job
+
+
+def run_job(job):
+    """Runs a single manifest job in a worker, returns a dict for the JSON line
+
+    Machines are kept between jobs and reset, ROM is loaded and decoded
+    once per worker as long as it is among the last MAX_MACHINES used.
+    """
+    result = {"line": job.get("line"), "rom": job.get("rom")}
+    try:
+        machine = _machines.pop(job["rom"], None)
+        if machine is None:
+            screen, kbd = bytearray(), Keyboard()
+            c = build_computer(job["rom"], lambda value: screen.append(value & 0xff), kbd)
+            c.useBlockCache()
+            machine = c, screen, kbd
+        _machines[job["rom"]] = machine
+        while len(_machines) > MAX_MACHINES:
+            del _machines[next(iter(_machines))]
+        c, screen, kbd = machine
+        c.reset()
+        c.r.pc = BASEADDR
+        screen.clear()
+        kbd.reset()
+        if "input" in job:
+            kbd.stream(job["input"])
+        run = c.run(max_instructions=job.get("instructions"), max_cycles=job.get("cycles"))
+        result.update(run._asdict())
+        if "expected" in job:
+            with open(job["expected"], "rb") as f:
+                result["passed"] = f.read() == screen
+        if not result.get("passed", False):
+            result["screen"] = screen.decode("latin-1")
+    except Exception as e:
+        result.update(error=f"{e.__class__.__name__}: {e}", passed=False)
+    return result
+
+
+def run_batch(jobs, workers=None):
+    """Runs jobs in a pool of processes, yields results as they get ready"""
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up) as pool:
+        for future in as_completed([pool.submit(run_job, job) for job in jobs]):
+            yield future.result()
+
+
+def cmd_batch(args):
+    failed = 0
+    try:
+        for result in run_batch(read_manifest(args.manifest), args.jobs):
+            failed += result.get("passed") is False
+            print(json.dumps(result), flush=True)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    return 1 if failed else 0
+
+
+def cmd_run(args):
+    result, screen = run_rom(args.rom, input_file=args.input, max_cycles=args.cycles,
+                             max_instructions=args.instructions,
+                             until_pc=args.until, blockcache=args.engine == "blocks",
+                             trace=args.trace, profile=args.profile)
+    if args.screen_out == "-":
+        sys.stdout.buffer.write(screen)
+        sys.stdout.flush()
+    elif args.screen_out is not None:
+        with open(args.screen_out, "wb") as f:
+            f.write(screen)
+    print(f"{result.reason}: {result.instructions} instructions, {result.cycles} cycles",
+          file=sys.stderr if args.screen_out == "-" else sys.stdout)
+    return 1 if result.reason == STOP_INTERRUPTED else 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="minicomp", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    run = commands.add_parser("run", help="run a ROM headless")
+    run.add_argument("rom", help="ROM image to load at the base address")
+    run.add_argument("--input", metavar="FILE", help="feed bytes of FILE to the keyboard")
+    run.add_argument("--cycles", metavar="N", type=int, help="stop after N cycles")
+    run.add_argument("--instructions", metavar="N", type=int, help="stop after N instructions")
+    run.add_argument("--until", metavar="ADDR", type=lambda x: int(x, 16),
+                     help="stop when PC reaches hexadecimal ADDR")
+    run.add_argument("--screen-out", metavar="FILE",
+                     help="save bytes written to the screen to FILE, - for stdout")
+    run.add_argument("--trace", metavar="FILE",
+                     help="record every instruction to gzipped FILE, see tracer.py")
+    run.add_argument("--profile", metavar="FILE",
+                     help="save call stacks in collapsed format for flame graph tools to FILE")
+    run.add_argument("--engine", choices=("step", "blocks"), default="blocks",
+                     help="execution engine, see `help engine` (default blocks)")
+    run.set_defaults(func=cmd_run)
+    batch = commands.add_parser("batch", help="run jobs of a manifest in parallel")
+    batch.add_argument("manifest", help="file with a JSON object per job per line")
+    batch.add_argument("--jobs", metavar="N", type=int,
+                       help="number of worker processes (default number of CPUs)")
+    batch.set_defaults(func=cmd_batch)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command is None:  # No command, start the interactive emulator.
+        import curses
+        import main as console
+        curses.wrapper(console.main)
+        return 0
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
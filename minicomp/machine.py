@@ -0,0 +1,26 @@
+"""The emulated computer: memory layout and IO addresses
+
+Shared by the interactive console and headless runs so that both see exactly
+the same machine.
+"""
+from cpu import CPU
+from mmu import FlatMMU, RAM, ROM
+
+
+BASEADDR = 0xe000
+SCREEN_ADDR = 1024
+KEYBOARD_ADDR = 1025
+
+
+def build_computer(fname, screen, keyboard):
+    """Returns a CPU with ROM loaded from fname and IO devices attached
+
+    screen is called with every byte written to SCREEN_ADDR, reads from
+    KEYBOARD_ADDR are served by keyboard.
+    """
+    # RAM(0x00, 0xdbff), everything in 0xdc00:0xdffe is for IO
+    with open(fname, "rb") as f:
+        m = FlatMMU(RAM(0x00, 0x1000), ROM(BASEADDR, 0x10000 - BASEADDR, f))
+    m.register_io(SCREEN_ADDR, screen)  # register specific method
+    m.register_io(KEYBOARD_ADDR, keyboard, "r")
+    return CPU(m, BASEADDR)
@@ -2,18 +2,21 @@ from collections import deque
 import ctypes
 import curses
 from functools import partial
-from itertools import cycle, chain, repeat, islice, takewhile, dropwhile
+import keyword
 import os
 import sys
+import time
 
-from cpu import CPU
+from cpu import END_OF_RUN, STOP_BREAK, STOP_WATCH
 from mmu import *
 from decorators import *
+from machine import *
+from profiler import Profiler, format_report
+from tracer import Tracer, format_record, opcode_names
 from utils import *
 
 
 NotEnoughArgs = TypeError
-BASEADDR = 0xe000
 
 
 def attribute_of_subattribute(obj, attribute, subattribute, sentinel=None):
@@ -35,22 +38,172 @@ def has_help_string(obj, attr):
     return attribute_has_attribute(obj, attr, help_reg_attr)
 
 
-class Cstr(str):
-    def __new__(cls, value, attr=None):
-        obj = str.__new__(cls, value)
-        obj.curses_attribute = attr
-        return obj
+# Command output is either a string or a list of spans: strings and
+# (text, curses attribute) pairs, the attribute is None for plain text.
 
-    def setcolor(self, color):
-        self.curses_attribute = color
 
-    @staticmethod
-    def join(separator="", iterable=""):
-        return list(islice(chain.from_iterable(zip(repeat(separator), iterable)), 1, None))
+def iter_spans(chars):
+    """Yields (text, attribute) pairs of command output
 
-    def __iter__(self):
-        for el in self.__str__():
-            yield Cstr(el, self.curses_attribute)
+    >>> list(iter_spans("ab")), list(iter_spans(["a", ("b", 1)]))
+    ([('ab', None)], [('a', None), ('b', 1)])
+    """
+    if isinstance(chars, str):
+        chars = [chars]
+    for span in chars:
+        yield (span, None) if isinstance(span, str) else span
+
+
+def memory_table(first, cells, highlighted=None, width=8):
+    """Returns spans of a table of cells, width cells per row
+
+    Rows start with the address of their first cell, first is the address of
+    cells[0]. Addresses outside of memory are ----. highlighted maps indices of
+    cells to attributes they are shown with.
+
+    >>> memory_table(0xfff8, ["00"]*10, {1: 7})
+    [('fff8   00 ', None), ('00', 7), (' 00 00 00 00 00 00\\n----   00 00', None)]
+    """
+    highlighted = highlighted or {}
+    spans, text = [], []
+    for row in range(0, len(cells), width):
+        start = first + row
+        text.append(f"{start:04x}   " if 0 <= start <= 0xffff else "----   ")
+        end = min(row + width, len(cells))
+        marked = [i for i in highlighted if row <= i < end]
+        if not marked:
+            text.append(" ".join(cells[row:end]))
+        else:
+            for i in range(row, end):
+                if i > row:
+                    text.append(" ")
+                if i in highlighted:
+                    spans.append(("".join(text), None))
+                    spans.append((cells[i], highlighted[i]))
+                    text = []
+                else:
+                    text.append(cells[i])
+        text.append("\n")
+    if text:
+        text.pop()  # No newline after the last row.
+    spans.append(("".join(text), None))
+    return spans
+
+
+class Renderer:
+    """Refreshes windows in batches, at most fps times a second
+
+    Windows are drawn to as usual and marked dirty instead of being refreshed
+    right away. `tick` pushes dirty windows to the terminal with a single
+    doupdate once 1/fps seconds have passed since the last time, `flush` does
+    it unconditionally (at the end of a command and after a key press). Windows
+    are refreshed in the order they were last marked, so the cursor ends up in
+    the window drawn to last.
+
+    >>> class Win:
+    ...     def __init__(self, name):
+    ...         self.name = name
+    ...     def noutrefresh(self):
+    ...         print("refresh", self.name)
+    >>> r = Renderer(fps=1, doupdate=lambda: print("doupdate"))
+    >>> a, b = Win("a"), Win("b")
+    >>> r.mark(a); r.mark(b); r.mark(a)
+    >>> r.tick()
+    refresh b
+    refresh a
+    doupdate
+    >>> r.mark(b); r.tick()  # Too early for another frame.
+    >>> r.flush()
+    refresh b
+    doupdate
+    """
+    def __init__(self, fps=30, doupdate=curses.doupdate):
+        self.interval = 1 / fps
+        self.doupdate = doupdate
+        self.dirty = {}  # Windows to refresh, dicts keep insertion order.
+        self.last = time.monotonic() - self.interval
+
+    def mark(self, win):
+        self.dirty.pop(win, None)
+        self.dirty[win] = True
+
+    def tick(self):
+        if self.dirty and time.monotonic() - self.last >= self.interval:
+            self.flush()
+
+    def flush(self):
+        for win in self.dirty:
+            win.noutrefresh()
+        self.dirty.clear()
+        self.doupdate()
+        self.last = time.monotonic()
+
+
+# All windows share it to have a single doupdate per frame.
+renderer = Renderer()
+
+
+class Scrollback:
+    """The last maxrows rows of console output wrapped at width columns
+
+    Rows are lists of (text, attribute) spans kept in a ring buffer, the
+    oldest ones are dropped once there are maxrows of them. Output goes to the
+    last row. Drawing needs just the rows in view, no matter how much output
+    there is.
+
+    >>> sb = Scrollback(width=4, maxrows=3)
+    >>> sb.write("abcdef\\n>>>")
+    >>> sb.view(2)
+    [[('ef', None)], [('>>>', None)]]
+    >>> sb.write("x"); sb.backspace(); sb.backspace()
+    >>> sb.view(1, offset=1), sb.view(1), sb.column
+    ([[('ef', None)]], [[('>>', None)]], 2)
+    """
+    def __init__(self, width, maxrows=10000):
+        self.width = width
+        self.rows = deque([[]], maxrows)
+        self.column = 0  # Length of the last row.
+
+    def __len__(self):
+        return len(self.rows)
+
+    def write(self, text, attr=None):
+        for i, line in enumerate(text.split("\n")):
+            if i:
+                self.newline()
+            while line:
+                if self.column == self.width:
+                    self.newline()
+                piece, line = line[:self.width - self.column], line[self.width - self.column:]
+                row = self.rows[-1]
+                if row and row[-1][1] == attr:
+                    row[-1] = (row[-1][0] + piece, attr)
+                else:
+                    row.append((piece, attr))
+                self.column += len(piece)
+
+    def newline(self):
+        self.rows.append([])
+        self.column = 0
+
+    def backspace(self):
+        """Removes the last character"""
+        if not self.rows[-1] and len(self.rows) > 1:
+            self.rows.pop()
+            self.column = sum(len(text) for text, _ in self.rows[-1])
+        row = self.rows[-1]
+        if row:
+            text, attr = row[-1]
+            if len(text) > 1:
+                row[-1] = (text[:-1], attr)
+            else:
+                row.pop()
+            self.column -= 1
+
+    def view(self, height, offset=0):
+        """Returns up to height rows ending offset rows above the last one"""
+        end = len(self.rows) - offset
+        return [self.rows[i] for i in range(max(end - height, 0), end)]
 
 
 class Console:
@@ -67,22 +220,21 @@ class Console:
             self.push_char(key)
 
     def push_chars(self, chars):
-        for ch in chars:
-            for subch in ch:  # a hack around Cstr
-                self.push_char(subch)
+        """Writes a string or a list of spans, a single addstr per span"""
+        for text, attr in iter_spans(chars):
+            self.current_line.extend(text)
+            if attr is None:
+                self.win.addstr(text)
+            else:
+                self.win.addstr(text, attr)
+        renderer.mark(self.win)
+        renderer.tick()
 
     def push_char(self, char):
-        for subch in char:  # a hack around Cstr
-            self.current_line.append(subch)
-            quux = getattr(subch, "curses_attribute", None)
-            if quux is None:
-                try:
-                    self.win.addch(subch)
-                except TypeError:
-                    raise Exception(f"Failed on '{char}' {len(char)} {type(char)}")
-            else:
-                self.win.addch(subch, quux)
-        self.win.refresh()
+        self.current_line.append(char)
+        self.win.addch(char)
+        renderer.mark(self.win)
+        renderer.tick()
 
     def activate(self):
         pass
@@ -109,13 +261,13 @@ class IOWin(Console):
     def activate(self):
         curses.curs_set(0)
         self.box.addstr(9,44, "-Active")
-        self.box.refresh()
-        self.win.refresh()
+        renderer.mark(self.box)
+        renderer.mark(self.win)
 
     def deactivate(self):
         self.box.addstr(9,44, "-------")
-        self.box.refresh()
-        self.win.refresh()
+        renderer.mark(self.box)
+        renderer.mark(self.win)
         curses.curs_set(1)
 
     # IOWindow just passes newline through to the underlying system.
@@ -142,7 +294,6 @@ class Stats:
         self.reset()
 
     def reset(self):
-        self.count = 0
         self.win.addstr(0, 0, f"PC {hex(BASEADDR)[2:]}")
         self.win.addstr(1, 0, "Sp 0000")  # ??
         self.win.addstr(2, 0, "A 00")
@@ -155,33 +306,42 @@ class Stats:
         self.win.addstr(9, 0, "0")
         self.win.refresh()
 
-    def update_stats(self, cpu, refresh=False):
-        """Updates individual field"""
-        self.count += cpu.cc
-        if refresh:
-            self.win.addstr(0, 0, f"PC {word(cpu.r.pc)}")
-            self.win.addstr(1, 0, f"Sp {word(cpu.r.s)}")
-            self.win.addstr(2, 0, f"A {byte(cpu.r.a)}")
-            self.win.addstr(3, 0, f"X {byte(cpu.r.x)}")
-            self.win.addstr(4, 0, f"Y {byte(cpu.r.y)}")
-            self.win.addstr(5, 0, f"N {'1' if cpu.r.getFlag('N') else '.'} V .")
-            self.win.addstr(6, 0, "B . D .")
-            self.win.addstr(7, 0, "I 1 C .")
-            self.win.addstr(8, 0, f"Z {'1' if cpu.r.getFlag('Z') else '.'}   ")
-            self.win.addstr(9, 0, f"{self.count}")
-            self.win.refresh()
+    def update_stats(self, cpu):
+        """Shows registers and the cycle counter of cpu"""
+        self.win.addstr(0, 0, f"PC {word(cpu.r.pc)}")
+        self.win.addstr(1, 0, f"Sp {word(cpu.r.s)}")
+        self.win.addstr(2, 0, f"A {byte(cpu.r.a)}")
+        self.win.addstr(3, 0, f"X {byte(cpu.r.x)}")
+        self.win.addstr(4, 0, f"Y {byte(cpu.r.y)}")
+        self.win.addstr(5, 0, f"N {'1' if cpu.r.getFlag('N') else '.'} V .")
+        self.win.addstr(6, 0, "B . D .")
+        self.win.addstr(7, 0, "I 1 C .")
+        self.win.addstr(8, 0, f"Z {'1' if cpu.r.getFlag('Z') else '.'}   ")
+        self.win.addstr(9, 0, f"{cpu.cycles}")
+        renderer.mark(self.win)
+        renderer.tick()
 
 class CmdProcessor:
     history_len = 500
+    # Long runs refresh the Stats panel every this many cycles to show they
+    # are alive.
+    stats_every = 250000
 
     def __init__(self, screen, cpumonitor):
         self.screen = screen
         self.cpumonitor = cpumonitor
         self.kdb = Keyboard("Hello, World!!!")
+        self.blockcache = False
+        self.tracer = None
+        self.profiler = None
+        # Called with lines of output of long commands (exefile) as they come,
+        # by default such output is returned all at once.
+        self.output = None
         self.reset_computer(fname=os.path.join(os.path.dirname(__file__), "echo.bin"))
         self.lastcmds = deque(maxlen=self.history_len)
         self._history_pos = -1
-        self.helps = dict((el, get_help_string(self, el))
+        # Commands which are Python keywords are methods with a trailing _.
+        self.helps = dict((el.rstrip("_"), get_help_string(self, el))
                            for el in filter(partial(has_help_string, self), dir(self)))
 
     @property
@@ -211,7 +371,6 @@ class CmdProcessor:
             self.history_pos = -1
 
     def reset_computer(self, fname=None):
-        # RAM(0x00, 0xdbff), everything in 0xdc00:0xdffe is for IO
         # TODO: will eventually need a character device to emulate storage.
         #       and that would require a system config.
         #       Such device would need a backing file and some commands.
@@ -223,11 +382,17 @@ class CmdProcessor:
         #         STORE               -- saves data to file ???
         if fname is not None:
             self.fname = fname
-        with open(self.fname, "rb") as f:
-            m = MMU(RAM(0x00, 0x1000), ROM(BASEADDR, 0x10000 - BASEADDR, f))
-        m.register_io(1024, self.screen.write)  # register specific method
-        m.register_io(1025, self.kdb, "r")
-        self.c = CPU(m, BASEADDR, observer=self.cpumonitor)
+        old = getattr(self, "c", None)
+        self.c = build_computer(self.fname, self.screen.write, self.kdb)
+        self.c.subscribe(self.cpumonitor.update_stats, END_OF_RUN)
+        self.c.subscribe(self.cpumonitor.update_stats, self.stats_every)
+        if old is not None:  # Breakpoints and watchpoints survive resets.
+            self.c.breakpoints = old.breakpoints
+            for addr, direction in old.watchpoints.items():
+                self.c.addWatchpoint(addr, direction)
+        self.c.useBlockCache(self.blockcache)
+        self.c.tracer = self.tracer
+        self.c.profiler = self.profiler
         self.kdb.reset()
 
     @register_help("Execute one (default) or more instructions")
@@ -235,76 +400,202 @@ class CmdProcessor:
     @precondition("numstep < 10**6", "E: too many steps")
     @precondition("numstep > 0", "E: cannot make less than one step")
     def step(self, numstep=1):
-        for _ in range(numstep - 1):
-            self.c.step()
-        self.c.step(refresh=True)
+        result = self.c.run(max_instructions=numstep)
+        return self._stop_message(result) if result.reason in (STOP_BREAK, STOP_WATCH) else ""
+
+    @register_help("Run /num/ instructions (no limit by default or with /until/) or until PC is /addr/")
+    @precondition("num != 'until' or addr is not None", "E: missing address")
+    @morph("num", to_count, "E: invalid number of instructions")
+    @morph("addr", substitute_pc, "IE: should never result in error")
+    @morph("addr", to_int, "E: not a number")
+    @precondition("num is None or num > 0", "E: cannot make less than one step")
+    @precondition("addr is None or 0x0000 <= addr <= 0xffff", "E: impossible address")
+    def run(self, num=None, addr=None):
+        return self._stop_message(self.c.run(max_instructions=num, until_pc=addr))
+
+    def _stop_message(self, result):
+        out = f"{result.reason}: {result.instructions} instructions, {result.cycles} cycles"
+        if result.reason == STOP_WATCH:
+            addr, direction = self.c.watchhit
+            out += f", {'read of' if direction == 'r' else 'write to'} {addr:04x}"
+        return out
+
+    @register_help("Stop running at /addr/, list breakpoints and watchpoints without it")
+    @morph("addr", substitute_pc, "IE: should never result in error")
+    @morph("addr", to_int, "E: not a number")
+    @precondition("addr is None or 0x0000 <= addr <= 0xffff", "E: impossible address")
+    def break_(self, addr=None):
+        if addr is not None:
+            self.c.breakpoints.add(addr)
+            return ""
+        return "\n".join([f"break {a:04x}" for a in sorted(self.c.breakpoints)] +
+                         [f"watch {a:04x} {d}" for a, d in sorted(self.c.watchpoints.items())])
+
+    @register_help("Stop running after /addr/ is read (r) or written (w, default)")
+    @missing_args("E: missing address")
+    @morph("addr", substitute_pc, "IE: should never result in error")
+    @morph("addr", to_int, "E: not a number")
+    @precondition("0x0000 <= addr <= 0xffff", "E: impossible address")
+    @precondition("direction in ('r', 'w')", "E: expected r or w")
+    def watch(self, addr, direction="w"):
+        self.c.addWatchpoint(addr, direction)
         return ""
 
-    @register_help("Add everything that follows verbatim to keyboard device")
+    @register_help("Delete breakpoint and watchpoint at /addr/, all of them without it")
+    @morph("addr", substitute_pc, "IE: should never result in error")
+    @morph("addr", to_int, "E: not a number")
+    @precondition("addr is None or 0x0000 <= addr <= 0xffff", "E: impossible address")
+    def delete(self, addr=None):
+        if addr is None:
+            addrs = self.c.breakpoints | set(self.c.watchpoints)
+        elif addr in self.c.breakpoints or addr in self.c.watchpoints:
+            addrs = {addr}
+        else:
+            return "E: nothing to delete"
+        for a in addrs:
+            self.c.breakpoints.discard(a)
+            self.c.deleteWatchpoint(a)
+        return ""
+
+    @register_help("Select execution /engine/: step (default) or blocks")
+    @missing_args("E: missing engine name")
+    @precondition("engine in ('step', 'blocks')", "E: unknown engine")
+    def engine(self, engine):
+        self.blockcache = engine == "blocks"
+        self.c.useBlockCache(self.blockcache)
+        return ""
+
+    @register_help("Turn instruction tracing on (streaming to /file/ if given) or off")
+    @missing_args("E: missing on or off")
+    @precondition("mode in ('on', 'off')", "E: expected on or off")
+    def trace(self, mode, fname=None):
+        if mode == "on" and self.profiler is not None:
+            return "E: turn profiling off first"
+        if self.tracer is not None:
+            self.tracer.close()
+        self.tracer = None
+        if mode == "on":
+            try:
+                self.tracer = Tracer(fname=fname)
+            except OSError:
+                return "E: cannot write file"
+        self.c.tracer = self.tracer
+        return ""
+
+    @register_help("Show /num/ (10 by default) last traced instructions")
+    @morph("num", to_int, "E: not a number")
+    @precondition("num > 0", "E: cannot show less than one instruction")
+    def showtrace(self, num=10):
+        if self.tracer is None:
+            return "E: tracing is off"
+        names = opcode_names(self.c._ops)
+        return "\n".join(format_record(rec, names) for rec in self.tracer.records(num))
+
+    @register_help("Count cycles per address and opcode: profile on, off or show /num/ top entries")
+    @missing_args("E: missing on, off or show")
+    @morph("num", to_int, "E: not a number")
+    @precondition("mode in ('on', 'off', 'show')", "E: expected on, off or show")
+    @precondition("num > 0", "E: cannot show less than one entry")
+    def profile(self, mode, num=10):
+        if mode == "on":
+            if self.tracer is not None:
+                return "E: turn tracing off first"
+            self.profiler = Profiler()
+        elif mode == "off":
+            self.profiler = None
+        elif self.profiler is None:
+            return "E: profiling is off"
+        self.c.profiler = self.profiler
+        if mode == "show":
+            return "\n".join(format_report(self.profiler, num, opcode_names(self.c._ops)))
+        return ""
+
+    @register_help("Save profiled call stacks to /file/ in collapsed format for flame graph tools")
+    @missing_args("E: missing filename")
+    def flamegraph(self, fname):
+        if self.profiler is None:
+            return "E: profiling is off"
+        try:
+            with open(fname, "w") as f:
+                for line in self.profiler.collapsed():
+                    f.write(line + "\n")
+        except OSError:
+            return "E: cannot write file"
+        return ""
+
+    @register_help("Add everything that follows verbatim to keyboard device, <file streams /file/")
     def addinpt(self, *a):
         # TODO: make this work with 0x10 0x77 etc. to provide actual hex codes.
-        # TODO: add <fname operator
         # TODO: add escape characters for 0x10 or even better:
         #       addinptraw 0x10  would result in 0x10 echoed to the screen
-        if a:
+        if a and a[0].startswith("<") and a[0][1:].strip():
+            try:
+                self.kdb.stream(a[0][1:].strip())
+            except OSError:
+                return "E: cannot read file"
+        elif a:
             for el in a:
                 self.kdb.extend(el.replace("\\n", "\n"))
         return ""
 
-    @register_help("Execute commands from /file/")
+    @register_help("Execute commands from /file/, /quiet/ does not echo them, /strict/ stops on an error")
     @missing_args("E: missing filename")
     @precondition("file_accessible(fname)", "E: cannot read file")
-    def exefile(self, fname):
+    @precondition("{mod1, mod2} <= {None, 'quiet', 'strict'}", "E: expected quiet or strict")
+    def exefile(self, fname, mod1=None, mod2=None):
+        # Scripts are read and echoed line by line: with an output sink echoed
+        # lines go there as they come and nothing piles up in memory.
+        quiet, strict = "quiet" in (mod1, mod2), "strict" in (mod1, mod2)
         out = []
+        emit = out.append if self.output is None else self.output
         try:
             with open(fname, "r") as f:
-                for line in f.readlines():
-                    out.append("..>"+line.rstrip())
-                    self.process(line.rstrip().split(" ", 1), update_last_command=False)
+                for num, line in enumerate(f, 1):
+                    line = line.rstrip()
+                    if not quiet:
+                        emit("..>" + line)
+                    result = self.process(line.split(" ", 1), update_last_command=False)
+                    if strict and isinstance(result, str) and result.startswith("E:"):
+                        emit(f"{result} (line {num})")
+                        break
         except Exception as e:
-            out.append("E: "+ str(e))
+            emit("E: "+ str(e))
         return "\n".join(out)
 
+    def memory_reprs(self, lo, hi, asascii=False):
+        """Returns representations of bytes from lo up to hi for tables
+
+        Unmapped bytes are NA, values of IO devices are peeked at once:
+        read_range does that within blocks. The second value returned maps
+        indices of IO values to the attribute they stand out with.
+        """
+        mmu, output, highlighted = self.c.mmu, ["NA"] * (hi - lo), {}
+        mapped = mmu.mapped_ranges(lo, hi)
+        for start, end in mapped:
+            output[start - lo:end - lo] = bytes_to_reprs(mmu.read_range(start, end), asascii)
+        for i, device in mmu.ioread.items():
+            if lo <= i < hi:
+                if not any(start <= i < end for start, end in mapped):
+                    output[i - lo] = byte_to_repr(device.peek(), asascii)
+                highlighted[i - lo] = curses.color_pair(100)
+        return output, highlighted
+
     @register_help("Show memory surrounding /addr/ /as hex/ or /as ascii/")
     @missing_args("E: missing address")
     @morph("addr", substitute_pc, "IE: should never result in error")
     @morph("addr", to_int, "E: not a number")
     @precondition("0x0000 <= addr <= 0xffff", "E: impossible address")
     def ctxt(self, addr, mod1="as", mod2="hex"):
-        # Cannot overflow over 0xffff or underflow below 0:
-        # Note, that to see _current address_ and two extra lines it must be
-        # + 15.
-        tmph, tmpl = addr + 15, addr -8
-        hi, lo = min(addr + 15, 0xffff), max(addr - 8, 0)
-        # Note: dump does NOT recenter by itself!
-        asascii, output = mod1 == "as" and mod2 == "ascii", ["--"] * abs(tmpl) if tmpl < 0 else []
-        # -- repreasents values outside of address range.
-        for i in range(lo, hi + 1):
-            if i in self.c.mmu.ioread:
-                val = byte_to_repr(self.c.mmu.ioread[i].peek(), asascii)
-                val = Cstr(val, curses.color_pair(100))
-            else:
-                val = mem_element(self.c.mmu, i, asascii)
-            output.append(val)
-        if tmph > 0xffff:
-            output.extend(["--"] * (tmph - 0xffff))
-        # Formatting the table:
-        # This code is a mess and requires lots more comments
-        # And it should still be a part of the dumper, but the dumper has to be smart
-        # enough to deal with context-aware and context-less ranges.
-        tbl_width = 8
-        diap = enumerate(range(0, len(output), 8), -1 if tmpl < 0 else 0)
-        if tmpl < 0:
-            addr = lambda ofs: word(lo + 8*ofs + 8 - abs(tmpl)) + "  " if tmpl > 0 or ofs >= 0 else "----  "
-        elif tmph > 0xffff:
-            addr = lambda ofs: word(lo + 8*ofs) + "  " if tmph < 0xffff or ofs < 2 else "----  "
-        else:
-            addr = lambda ofs: word(lo + 8*ofs) + "  "
-        output = [[addr(ofs)] + output[val:val+8] for ofs, val in diap]
-        output = [Cstr.join(" ", x) for x in output]
-        # TODO: the behavior appears to be correct, now please simplify this and
-        # unify with dump. Both must be clients of the same helper function.
-        return list(Cstr.join("\n", output))  # Has to be a list to preserve attributes.
+        # Three rows, the middle one starts at addr. Cannot overflow over
+        # 0xffff or underflow below 0: -- repreasents values outside of
+        # address range.
+        first, last = addr - 8, addr + 16
+        lo, hi = max(first, 0), min(last, 0x10000)
+        asascii = mod1 == "as" and mod2 == "ascii"
+        output, highlighted = self.memory_reprs(lo, hi, asascii)
+        output = ["--"] * (lo - first) + output + ["--"] * (last - hi)
+        highlighted = {i + lo - first: attr for i, attr in highlighted.items()}
+        return memory_table(first, output, highlighted)
 
     @register_help("Read memory from /addr/")
     @missing_args("E: missing address")
@@ -337,11 +628,11 @@ class CmdProcessor:
 
     @register_help("Show keyboard buffer")
     def showkbd(self, *a, **k):
-        return "".join(chr(x) for x in self.kdb.buff)
+        return self.kdb.pending()
 
     @register_help("Clean keyboard buffer")
     def clrkbd(self, *a, **k):
-        self.kdb.buff.clear()
+        self.kdb.clear()
 
     @register_help("Show help for /command/")
     def help(self, command="", *a, **k):
@@ -366,7 +657,7 @@ class CmdProcessor:
         self.screen.push_chars("\n\n")
         return ""
 
-    @register_help("Update ROM from /file/ without resetting CPU state")
+    @register_help("Update ROM from /file/ without resetting CPU state, only changed bytes are written")
     @missing_args("E: missing filename")
     @precondition("file_accessible(fname)", "E: cannot read file")
     def patch(self, fname):
@@ -375,9 +666,11 @@ class CmdProcessor:
         # once something more complex is introduced.
         with open(fname, "rb") as f:
             data = f.read()
-        for addr, val in enumerate(data, BASEADDR):
-            self.c.mmu.write(addr, val, False)
-        return ""
+        changed = self.c.mmu.patch(BASEADDR, data)
+        if not changed:
+            return "unchanged"
+        return "changed: " + ", ".join(
+            f"{lo:04x}" if hi - lo == 1 else f"{lo:04x}-{hi - 1:04x}" for lo, hi in changed)
 
     @register_help("Dump memory from /lo/ to /hi/ /as hex/ or /as ascii/")
     @missing_args("E: not enough arguments")
@@ -389,21 +682,8 @@ class CmdProcessor:
     @precondition("0x0000 <= hi <= 0xffff", "E: impossible hiaddr")
     @precondition("lo <= hi", "E: loaddr > hiaddr")
     def dump(self, lo, hi, mod1="as", mod2="hex"):
-        asascii, output = mod1 == "as" and mod2 == "ascii", []
-        for i in range(lo, hi):
-            if i in self.c.mmu.ioread:
-                val = byte_to_repr(self.c.mmu.ioread[i].peek(), asascii)
-                val = Cstr(val, curses.color_pair(100))
-            else:
-                val = mem_element(self.c.mmu, i, asascii)
-            output.append(val)
-        # Formatting the table:
-        tbl_width = 8
-        diap = enumerate(range(0, len(output), 8))
-        addr = lambda ofs: word(lo + 8*ofs) + "  "
-        output = [[addr(ofs)] + output[val:val+8] for ofs, val in diap]
-        output = [Cstr.join(" ", x) for x in output]
-        return list(Cstr.join("\n", output))  # Has to be a list to preserve attributes.
+        asascii = mod1 == "as" and mod2 == "ascii"
+        return memory_table(lo, *self.memory_reprs(lo, hi, asascii))
 
     @register_help("Display ASCII, dec, hex, oct and bin data about /val/")
     @missing_args("E: missing argument")
@@ -434,7 +714,8 @@ class CmdProcessor:
             # You do not know it when you have executed a script, but you probably
             # don't want to re-run the entire script anyway.
             return self.process(self.lastcmd)
-        torun = getattr(self, cmd[0], lambda *a, **k: f"E: Unknown command")
+        name = cmd[0] + "_" if keyword.iskeyword(cmd[0]) else cmd[0]
+        torun = getattr(self, name, lambda *a, **k: f"E: Unknown command")
         if cmd[0] != "addinpt":
             args = [x for x in "".join(cmd[1:]).split(" ") if x]
         else:  # addinpt is a special case: it passes everything to keyboard verbatim.
@@ -449,29 +730,92 @@ class CmdProcessor:
 
 
 class CtrlConsole(Console):
+    """Command line with a scrollback, PgUp and PgDn page through it
+
+    Output goes to a Scrollback rather than straight to the window. The window
+    shows just a viewport of it, which is redrawn when the renderer gets to
+    it, so long outputs cost as much as the rows on screen.
+    """
+    scrollback_rows = 10000
+
     def __init__(self, cmdprocessor=None):
         self.cmdprocessor = cmdprocessor
+        if cmdprocessor is not None:
+            cmdprocessor.output = lambda line: self.show(line + "\n")
         self.win = curses.newwin(curses.LINES - 10, 52, 10, 0)
         super(CtrlConsole, self).__init__()
+        self.win.scrollok(False)  # The scrollback does the scrolling.
+        self.height, self.width = self.win.getmaxyx()
+        self.scrollback = Scrollback(self.width, self.scrollback_rows)
+        self.offset = 0  # Rows the view is scrolled back by.
         self.push_chars(">>>")
-        self.win.refresh()
+        renderer.flush()
+
+    def show(self, chars):
+        """Adds output to the scrollback and scrolls down to it"""
+        for text, attr in iter_spans(chars):
+            self.scrollback.write(text, attr)
+        self.offset = 0
+        renderer.mark(self)
+        renderer.tick()
+
+    def push_chars(self, chars):
+        for text, _ in iter_spans(chars):
+            self.current_line.extend(text)
+        self.show(chars)
+
+    def push_char(self, char):
+        self.push_chars(char)
+
+    def noutrefresh(self):
+        """Draws the rows in view, called by the renderer"""
+        self.win.erase()
+        rows = self.scrollback.view(self.height, self.offset)
+        for y, row in enumerate(rows):
+            x = 0
+            for text, attr in row:
+                try:
+                    self.win.addstr(y, x, text, attr or curses.A_NORMAL)
+                except curses.error:  # The bottom right cell leaves the cursor nowhere.
+                    pass
+                x += len(text)
+        if rows and self.offset == 0:
+            self.win.move(len(rows) - 1, min(self.scrollback.column, self.width - 1))
+        self.win.noutrefresh()
+
+    def process_page_up(self):
+        self.offset = min(self.offset + self.height - 1, max(len(self.scrollback) - self.height, 0))
+        renderer.mark(self)
+
+    def process_page_down(self):
+        self.offset = max(self.offset - (self.height - 1), 0)
+        renderer.mark(self)
 
     def process_command(self):
         cmd = "".join(self.current_line).lstrip(">").lstrip().split(" ", 1)
         if cmd:
             self.current_line.clear()
-            result = self.cmdprocessor.process(cmd)
+            # Raw mode swallows Ctrl-C as a key, long runs need it as a signal
+            # to stay interruptible. CPU.run() catches it by itself, the rest
+            # of the commands just get cancelled.
+            curses.noraw()
+            curses.cbreak()
+            try:
+                result = self.cmdprocessor.process(cmd)
+            except KeyboardInterrupt:
+                result = "KeyboardInterrupt"
+            finally:
+                curses.raw()
             return result
         return ""
 
     def process_backspace(self):
         if len(self.current_line) <= 3:
             return
-        y, x = self.win.getyx()
-        self.win.addch(y, x-1, " ")
         self.current_line.pop(-1)
-        self.win.move(y, x-1)
-        self.win.refresh()
+        self.scrollback.backspace()
+        self.offset = 0
+        renderer.mark(self)
 
     def process_cc(self):  # For history processing, currently broken, at this point must be replaced with readline.
         self.cmdprocessor.history_pos = -1
@@ -493,14 +837,15 @@ class CtrlConsole(Console):
             self.push_chars(self.cmdprocessor.lastcmds[self.cmdprocessor.history_pos])
 
     def process_return(self):
-        self.win.addch("\n")
+        self.show("\n")
         msg = self.process_command()  # process current line here
         if msg:
-            self.push_chars(msg)
-            self.win.addch("\n")
+            self.show(msg)
+            self.show("\n")
         self.current_line.clear()  # Now must clean again!
         self.push_chars(">>>")
         self.cmdprocessor.history_pos = -1  # resets history position
+        renderer.flush()
 
 
 # NOTE: Vim's sign column is just 2 chars wide. To have a running
@@ -537,8 +882,13 @@ def main(stdscr):
                 currwin.process_key_up()
             elif key == "KEY_DOWN":
                 currwin.process_key_down()
+            elif key == "KEY_PPAGE":
+                currwin.process_page_up()
+            elif key == "KEY_NPAGE":
+                currwin.process_page_down()
             else:
                 pass  # ignore everything else
+        renderer.flush()
     stdscr.getkey()
 
 
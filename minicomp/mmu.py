@@ -1,5 +1,9 @@
 import array
-from collections import namedtuple
+import atexit
+import copy
+from collections import deque, namedtuple
+import time
+import weakref
 
 
 class MemoryRangeError(ValueError):
@@ -10,6 +14,38 @@ class ReadOnlyError(TypeError):
     pass
 
 
+# Contents of a memory block at the moment of MMU.snapshot(), memory is bytes.
+BlockState = namedtuple("BlockState", "start length readonly memory")
+
+
+def changed_ranges(old, new, chunk=64):
+    """
+    Returns a list of (lo, hi) offset ranges where old and new differ, both
+    must support the buffer protocol and have the same length. Equal chunks
+    are skipped with a single comparison.
+
+    >>> changed_ranges(b"abcdefgh", b"abXYefgZ")
+    [(2, 4), (7, 8)]
+    >>> changed_ranges(b"abc", b"abc")
+    []
+    """
+    old, new, ranges = memoryview(old), memoryview(new), []
+    for base in range(0, len(new), chunk):
+        if old[base:base + chunk] == new[base:base + chunk]:
+            continue
+        for i in range(base, min(base + chunk, len(new))):
+            if old[i] != new[i]:
+                if ranges and ranges[-1][1] == i:
+                    ranges[-1] = (ranges[-1][0], i + 1)
+                else:
+                    ranges.append((i, i + 1))
+    return ranges
+
+
+# Bits of MMU.iopages.
+IO_READ, IO_WRITE = 1, 2
+
+
 def RAM(lower, upper):
     """Helper function to make Memory creation easier"""
     return (lower, upper)
@@ -35,31 +71,207 @@ class MemIODevice:
         pass
 
 
+class Register:
+    """
+    A single register of a device spanning several addresses, see
+    MMU.register_io_range. Looks like an ordinary single-address device: it is
+    called with values written and has read and peek.
+    """
+    def __init__(self, device, offset):
+        self.device = device
+        self.offset = offset
+
+    def __call__(self, value):
+        self.device.write(self.offset, value)
+
+    def read(self):
+        return self.device.read(self.offset)
+
+    def peek(self):
+        return self.device.peek(self.offset)
+
+
+# Screens flushed at exit, weak so that dropped screens do not stay around.
+_screens = weakref.WeakSet()
+
+
+@atexit.register
+def _close_screens():
+    for screen in list(_screens):
+        screen.close()
+
+
 class Screen(MemIODevice):
+    """
+    Logs everything written to it to a file: a "Screen got X" line per byte
+    or, with raw set, bytes as they are. The file is opened on the first write
+    and kept open, output piles up in a buffer which is flushed once it has
+    buffer_size bytes, when flush_interval seconds have passed since the last
+    flush (checked on writes), on close, at exit and when the screen is
+    garbage collected.
+
+    >>> import os, tempfile
+    >>> fname = os.path.join(tempfile.mkdtemp(), "screen.log")
+    >>> screen = Screen(fname, raw=True)
+    >>> for ch in b"Hi!":
+    ...     screen.write(ch)
+    >>> screen.close()
+    >>> open(fname, "rb").read()
+    b'Hi!'
+    """
+    def __init__(self, fname="/tmp/screenio.log", raw=False, buffer_size=4096, flush_interval=1.0):
+        self.fname = fname
+        self.raw = raw
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buff = bytearray()
+        self.f = None
+        self.last_flush = time.monotonic()
+        _screens.add(self)
+
     def write(self, value):
-        with open("/tmp/screenio.log", "a") as f:
-            f.write(f"Screen got {chr(value)}\n")
+        if self.raw:
+            self.buff.append(value & 0xff)
+        else:
+            self.buff += f"Screen got {chr(value)}\n".encode()
+        if (len(self.buff) >= self.buffer_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self.buff:
+            if self.f is None:
+                self.f = open(self.fname, "ab")
+            self.f.write(self.buff)
+            self.f.flush()
+            self.buff.clear()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    __del__ = close
 
 
 class Keyboard(MemIODevice):
+    """
+    Hands out input a byte per read, 0 once there is nothing left.
+
+    Input sits in a bytearray with a read cursor, so reads cost the same no
+    matter how much input is queued. Files (or FIFOs) given to `stream` are
+    read lazily a chunk at a time when everything queued before them has been
+    read, they are never loaded whole.
+
+    >>> kbd = Keyboard("ab")
+    >>> kbd.extend(b"c")
+    >>> kbd.pending()
+    'abc'
+    >>> [kbd.read() for _ in range(4)]
+    [97, 98, 99, 0]
+
+    Input added while the ROM reads does not pile up behind the cursor:
+    >>> kbd.extend(bytes(Keyboard.CHUNK)); _ = [kbd.read() for _ in range(Keyboard.CHUNK)]
+    >>> kbd.extend(b"d"); len(kbd.buff), kbd.pending()
+    (1, 'd')
+    """
+    CHUNK = 0x10000
+
     def __init__(self, buff=""):
         self.initial = buff[:]
+        self.sources = deque()  # Input queued after buff: bytes and open files.
         self.reset()
 
     def read(self):
-        if not self.buff:
+        if self.pos >= len(self.buff) and not self._refill():
             return 0
-        retval = self.buff.pop(0)
+        retval = self.buff[self.pos]
+        self.pos += 1
         return retval
 
+    def peek(self):
+        """
+        Returns the next byte if it is already at hand, 0 otherwise. Streamed
+        files are never read here, looking at memory must neither block on a
+        FIFO nor move file contents to the buffer.
+
+        >>> import os, tempfile
+        >>> fname = os.path.join(tempfile.mkdtemp(), "input")
+        >>> with open(fname, "wb") as f:
+        ...     _ = f.write(b"x")
+        >>> kbd = Keyboard()
+        >>> kbd.stream(fname)
+        >>> kbd.peek(), kbd.pending() == f"<{fname}", kbd.read(), kbd.peek()
+        (0, True, 120, 0)
+        >>> kbd.clear()
+        """
+        if self.pos < len(self.buff):
+            return self.buff[self.pos]
+        if self.sources and isinstance(self.sources[0], bytes):
+            return self.sources[0][0]
+        return 0
+
     def extend(self, values):
-        self.buff.extend(ord(x) for x in values)
+        """Queues str (characters are taken as Latin-1) or bytes"""
+        if isinstance(values, str):
+            values = values.encode("latin-1", errors="replace")
+        if self.sources:
+            if values:
+                self.sources.append(bytes(values))
+            return
+        if self.pos >= self.CHUNK:  # Drop what has been read already.
+            del self.buff[:self.pos]
+            self.pos = 0
+        self.buff += values
+
+    def stream(self, fname):
+        """
+        Queues the contents of a file, raises OSError if it cannot be opened
 
-    def peek(self):
-        return self.buff[0] if self.buff else 0
+        A FIFO blocks like it does for any reader: opening it waits for a
+        writer and reading waits for data until the writer closes it.
+        """
+        self.sources.append(open(fname, "rb", buffering=0))
+
+    def _refill(self):
+        """Moves the next piece of queued input to the buffer, False if none"""
+        del self.buff[:]
+        self.pos = 0
+        while self.sources and not self.buff:
+            source = self.sources[0]
+            if isinstance(source, bytes):
+                self.buff += self.sources.popleft()
+                continue
+            chunk = source.read(self.CHUNK)  # Whatever a FIFO has, up to CHUNK.
+            if chunk:
+                self.buff += chunk
+            else:
+                self.sources.popleft().close()
+        return bool(self.buff)
+
+    def pending(self):
+        """Returns queued input, files which are not read yet show as <fname"""
+        out = [self.buff[self.pos:].decode("latin-1")]
+        for source in self.sources:
+            if isinstance(source, bytes):
+                out.append(source.decode("latin-1"))
+            else:
+                out.append(f"<{source.name}")
+        return "".join(out)
+
+    def clear(self):
+        while self.sources:
+            source = self.sources.popleft()
+            if not isinstance(source, bytes):
+                source.close()
+        self.buff = bytearray()
+        self.pos = 0
 
     def reset(self):
-        self.buff = [ord(x) for x in self.initial]
+        self.clear()
+        self.extend(self.initial)
 
 
 class MMU:
@@ -77,30 +289,63 @@ class MMU:
         self.blocks = []
         self.iowrite = {}
         self.ioread = {}
+        # IO_READ and IO_WRITE bits of pages with IO devices, accesses to other
+        # pages never look into the tables above.
+        self.iopages = bytearray(0x100)
+        # Called with (lo, hi) whenever ROM is overwritten with protection off,
+        # that is the way for caches of decoded ROM contents to learn that
+        # they have gone stale.
+        self.rom_write_hooks = []
+        # Bumped on every change of ROM. Snapshots share bytes copies of ROM
+        # blocks as long as it stays the same, see `snapshot`.
+        self.rom_generation = 0
+        self._rom_copies = (0, {})  # (generation, block start -> bytes)
+        # Watched addresses: addr -> hook(addr, direction), see `watch`.
+        self.rwatch, self.wwatch = {}, {}
 
         for b in blocks:
             self.addBlock(*b)
 
     def register_io(self, address, iodevice, direction="w"):
         # TODO: check that a device is not added twice
-        # iodevice is a method that accepts single value
-        # one generic write method is not enough: consider devices that
-        # require a data bus and a control bus on two separate addresses
-        # this would require setting one and then another.
+        # iodevice is a method that accepts single value, devices with
+        # several registers (e.g. data and control) use register_io_range.
         if direction == "w":
             self.iowrite[address] = iodevice
+            self.iopages[address >> 8] |= IO_WRITE
         elif direction == "r":
             self.ioread[address] = iodevice
+            self.iopages[address >> 8] |= IO_READ
         else:
             print("Error: cannot register {iodevice}, expected direction in (r, w), got {direction}")
 
+    def register_io_range(self, address, size, iodevice, direction="rw"):
+        """
+        Registers a device with size registers starting at address. The device
+        gets offsets of registers: read(offset), peek(offset) and
+        write(offset, value) are called for accesses in directions given.
+
+        >>> class Pair(MemIODevice):
+        ...     def __init__(self): self.regs = [0, 0]
+        ...     def write(self, offset, value): self.regs[offset] = value
+        ...     def read(self, offset): return self.regs[offset] + 1
+        >>> m, dev = MMU(RAM(0x00, 0x100)), Pair()
+        >>> m.register_io_range(0x10, 2, dev)
+        >>> m.write(0x11, 41); m.write(0x12, 7)
+        >>> dev.regs, m.read(0x11), m.read(0x12)
+        ([0, 41], 42, 7)
+        """
+        for offset in range(size):
+            for d in direction:
+                self.register_io(address + offset, Register(iodevice, offset), d)
+
     def reset(self):
         """
         In all writeable blocks reset all values to zero.
         """
         for b in self.blocks:
             if not b['readonly']:
-                b['memory'] = array.array('B', [0]*b['length'])
+                b['memory'] = array.array('B', bytes(b['length']))
 
     def addBlock(self, start, length, readonly=False, value=None, valueOffset=0):
         """
@@ -134,21 +379,32 @@ class MMU:
 
         newBlock = {
             'start': start, 'length': length, 'readonly': readonly,
-            'memory': array.array('B', [0]*length)
+            'memory': self._allocate(start, length)
         }
+        if value is not None:
+            self._fill(newBlock['memory'], value, valueOffset)
 
-        # TODO: implement initialization value
-        if type(value) == list:
-            for i in range(len(value)):
-                newBlock['memory'][i+valueOffset] = value[i]
+        self.blocks.append(newBlock)
 
-        elif value is not None:
-            a = array.array('B')
-            a.frombytes(value.read())
-            for i in range(len(a)):
-                newBlock['memory'][i+valueOffset] = a[i]
+    def _allocate(self, start, length):
+        """Returns zeroed memory for a new block"""
+        return array.array('B', bytes(length))
 
-        self.blocks.append(newBlock)
+    @staticmethod
+    def _fill(memory, value, offset):
+        """
+        Copies value, a file or a list of unsigned integers, into memory at
+        offset. Files are read straight into memory without temporary copies.
+        """
+        dest = memoryview(memory)[offset:]
+        if type(value) == list:
+            if len(value) > len(dest):
+                raise MemoryRangeError("Value does not fit in the block")
+            dest[:len(value)] = bytes(value)
+        else:
+            value.readinto(dest)
+            if value.read(1):
+                raise MemoryRangeError("File does not fit in the block")
 
     def getBlock(self, addr):
         """
@@ -171,12 +427,16 @@ class MMU:
         """
         Write a value to the given address if it is writeable.
         """
-        if addr in self.iowrite:
+        if self.wwatch and addr in self.wwatch:
+            self.wwatch[addr](addr, "w")
+        if self.iopages[addr >> 8] & IO_WRITE and addr in self.iowrite:
             self.iowrite[addr](value)
         else:
             b = self.getBlock(addr)
-            if b['readonly'] and protect_rom:
-                raise ReadOnlyError()
+            if b['readonly']:
+                if protect_rom:
+                    raise ReadOnlyError()
+                self._rom_written(addr, addr + 1)
             i = self.getIndex(b, addr)
             b['memory'][i] = value & 0xff
 
@@ -184,12 +444,340 @@ class MMU:
         """
         Return the value at the address.
         """
-        if addr in self.ioread:
+        if self.rwatch and addr in self.rwatch:
+            self.rwatch[addr](addr, "r")
+        if self.iopages[addr >> 8] & IO_READ and addr in self.ioread:
             return self.ioread[addr].read()
         else:
             b = self.getBlock(addr)
             i = self.getIndex(b, addr)
             return b['memory'][i]
 
+    def watch(self, addr, direction, hook):
+        """
+        Calls hook(addr, direction) on every read ("r") or write ("w") of addr.
+
+        >>> m = MMU(RAM(0x00, 0x100))
+        >>> m.watch(0x10, "r", lambda addr, direction: print(hex(addr), direction))
+        >>> m.read(0x11), m.read(0x10)
+        0x10 r
+        (0, 0)
+        >>> m.unwatch(0x10, "r"); m.read(0x10)
+        0
+        """
+        (self.rwatch if direction == "r" else self.wwatch)[addr] = hook
+
+    def unwatch(self, addr, direction):
+        (self.rwatch if direction == "r" else self.wwatch).pop(addr, None)
+
     def readWord(self, addr):
         return (self.read(addr+1) << 8) + self.read(addr)
+
+    def mapped_ranges(self, lo, hi):
+        """Returns sorted (lo, hi) parts of [lo, hi) which are covered by blocks
+
+        >>> m = MMU(RAM(0x00, 0x100), ROM(0x100, 0x10, [0xea]), RAM(0x200, 0x10))
+        >>> [(hex(a), hex(b)) for a, b in m.mapped_ranges(0xf0, 0x208)]
+        [('0xf0', '0x110'), ('0x200', '0x208')]
+        """
+        found = []
+        for start, end in sorted((max(lo, b['start']), min(hi, b['start'] + b['length']))
+                                 for b in self.blocks
+                                 if b['start'] < hi and lo < b['start'] + b['length']):
+            if found and start <= found[-1][1]:
+                found[-1] = (found[-1][0], max(end, found[-1][1]))
+            else:
+                found.append((start, end))
+        return found
+
+    def read_range(self, lo, hi):
+        """
+        Returns a bytes-like object with memory from lo up to hi as reads would
+        see it, but without side effects: IO devices are peeked at. Raises
+        IndexError if a part of the range is not mapped.
+
+        >>> m = MMU(RAM(0x00, 0x100))
+        >>> m.write(0x10, 0x42); m.register_io(0x11, Keyboard("a"), "r")
+        >>> bytes(m.read_range(0x0f, 0x13))
+        b'\\x00Ba\\x00'
+        """
+        self._check_mapped(lo, hi)
+        out = bytearray(max(hi - lo, 0))
+        for b in self.blocks:
+            start, end = max(lo, b['start']), min(hi, b['start'] + b['length'])
+            if start < end:
+                out[start - lo:end - lo] = memoryview(b['memory'])[start - b['start']:end - b['start']]
+        return self._peek_io(out, lo, hi)
+
+    def _check_mapped(self, lo, hi):
+        covered = lo
+        for start, end in self.mapped_ranges(lo, hi):
+            if start > covered:
+                break
+            covered = end
+        if covered < hi:
+            raise IndexError(f"Address {hex(covered)}({covered}) not found in any blocks!")
+
+    def _peek_io(self, out, lo, hi):
+        """Puts values of read IO devices within [lo, hi) into out"""
+        if any(self.iopages[p] & IO_READ for p in range(lo >> 8, ((hi - 1) >> 8) + 1)):
+            for addr, device in self.ioread.items():
+                if lo <= addr < hi:
+                    out[addr - lo] = device.peek() & 0xff
+        return out
+
+    def patch(self, addr, data):
+        """
+        Writes data starting at addr ignoring ROM protection, but only where it
+        differs from current memory contents. Returns a list of (lo, hi) address
+        ranges that were changed, changes to ROM are reported to
+        rom_write_hooks range by range.
+        """
+        end = addr + len(data)
+        blocks = sorted((b for b in self.blocks if b['start'] < end and addr < b['start'] + b['length']),
+                        key=lambda b: b['start'])
+        covered = addr
+        for b in blocks:
+            if b['start'] > covered:
+                break
+            covered = max(covered, b['start'] + b['length'])
+        if covered < end:
+            raise IndexError(f"Address {hex(covered)}({covered}) not found in any blocks!")
+        data, changed = memoryview(bytes(data)), []
+        for b in blocks:
+            lo, hi = max(addr, b['start']), min(end, b['start'] + b['length'])
+            mem = memoryview(b['memory'])[lo - b['start']:hi - b['start']]
+            new = data[lo - addr:hi - addr]
+            for rlo, rhi in changed_ranges(mem, new):
+                mem[rlo:rhi] = new[rlo:rhi]
+                changed.append((lo + rlo, lo + rhi))
+                if b['readonly']:
+                    self._rom_written(lo + rlo, lo + rhi)
+        return changed
+
+    def _rom_written(self, lo, hi):
+        self.rom_generation += 1
+        for hook in self.rom_write_hooks:
+            hook(lo, hi)
+
+    def _rom_copy(self, b):
+        """Returns bytes of ROM block b, the same object until ROM changes"""
+        generation, copies = self._rom_copies
+        if generation != self.rom_generation:
+            copies = {}
+            self._rom_copies = self.rom_generation, copies
+        saved = copies.get(b['start'])
+        if saved is None:
+            saved = copies[b['start']] = bytes(b['memory'])
+        return saved
+
+    def snapshot(self):
+        """Returns an immutable copy of all blocks, a tuple of BlockState
+
+        Only RAM is copied every time, snapshots taken while ROM stays the
+        same share its copy and restoring them leaves ROM alone.
+
+        >>> m = FlatMMU(RAM(0x00, 0x100), ROM(0x100, 0x100, [0xea]))
+        >>> snap = m.snapshot()
+        >>> m.write(0x20, 1)
+        >>> m.restore(snap)
+        >>> m.read(0x20), snap[0].memory[0x20]
+        (0, 0)
+        >>> m.snapshot()[1].memory is snap[1].memory
+        True
+        >>> _ = m.patch(0x100, [0x00])
+        >>> m.snapshot()[1].memory is snap[1].memory, m.snapshot()[1].memory[0]
+        (False, 0)
+        >>> m.restore(snap); m.read(0x100)
+        234
+        """
+        return tuple(BlockState(b['start'], b['length'], b['readonly'],
+                                self._rom_copy(b) if b['readonly'] else bytes(b['memory']))
+                     for b in self.blocks)
+
+    def restore(self, snapshot):
+        """
+        Puts contents of blocks saved by `snapshot` back. Memory layout must be
+        the same, ROM is loaded only if it has changed since and such changes
+        are reported to rom_write_hooks.
+        """
+        if [(s.start, s.length) for s in snapshot] != [(b['start'], b['length']) for b in self.blocks]:
+            raise MemoryRangeError("Snapshot does not match memory layout")
+        for b, state in zip(self.blocks, snapshot):
+            if not b['readonly']:
+                self._load_block(b, state.memory)
+                continue
+            saved = self._rom_copy(b)
+            if state.memory is saved or state.memory == saved:
+                continue
+            self._load_block(b, state.memory)
+            self._rom_written(b['start'], b['start'] + b['length'])
+
+    def _load_block(self, b, data):
+        b['memory'] = array.array('B', data)
+
+
+# Kinds of pages in FlatMMU page table.
+UNMAPPED, RAM_PAGE, ROM_PAGE, IO_PAGE, MIXED_PAGE = range(5)
+
+
+class FlatMMU(MMU):
+    """MMU backed by one contiguous 64K memory and a 256-entry page table
+
+    Blocks work as before, but their memory is a view into a single bytearray.
+    Every page is marked as RAM, ROM, IO, unmapped or mixed (partially covered
+    by a block) and has a read and a write handler. Handler is None where a
+    plain index operation is enough: reads of RAM and ROM pages and writes to
+    RAM pages. Everything else goes to the generic MMU code which knows about
+    IO devices, ROM protection and unmapped addresses.
+
+    >>> m = FlatMMU(RAM(0x00, 0x1000), ROM(0xe000, 0x2000, [0xea]))
+    >>> m.write(0x10, 0x42)
+    >>> m.read(0x10), m.read(0xe000)
+    (66, 234)
+    >>> [m.pagekind[p] == k for p, k in ((0x00, RAM_PAGE), (0xe0, ROM_PAGE), (0x80, UNMAPPED))]
+    [True, True, True]
+    >>> m.write(0xe000, 0)  # doctest:+ELLIPSIS +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ReadOnlyError: ...
+    >>> m.read(0x8000)  # doctest:+ELLIPSIS +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    IndexError: ...
+
+    Pages with watched addresses get handlers which report accesses first:
+    >>> m.watch(0x10, "w", lambda addr, direction: print(hex(addr), direction))
+    >>> m.write(0x11, 1); m.write(0x10, 2)
+    0x10 w
+    >>> m.read(0x10)
+    2
+    """
+    def __init__(self, *blocks):
+        self.mem = bytearray(0x10000)
+        self.pagekind = bytearray(0x100)
+        # Nothing is mapped yet, so everything goes the slow way.
+        self.rpage = [MMU.read.__get__(self)]*0x100
+        self.wpage = [MMU.write.__get__(self)]*0x100
+        super(FlatMMU, self).__init__(*blocks)
+
+    def addBlock(self, start, length, readonly=False, value=None, valueOffset=0):
+        if start < 0 or start + length > len(self.mem):
+            raise MemoryRangeError()
+        super(FlatMMU, self).addBlock(start, length, readonly, value, valueOffset)
+        self._map_pages(start >> 8, ((start + length - 1) >> 8) + 1)
+
+    def _allocate(self, start, length):
+        view = memoryview(self.mem)[start:start + length]
+        view[:] = bytes(length)
+        return view
+
+    def register_io(self, address, iodevice, direction="w"):
+        super(FlatMMU, self).register_io(address, iodevice, direction)
+        self._map_pages(address >> 8, (address >> 8) + 1)
+
+    def watch(self, addr, direction, hook):
+        """
+        Only pages with watched addresses get handlers which check for them.
+        Slow handlers of other pages are the generic MMU code which does that
+        itself.
+        """
+        super(FlatMMU, self).watch(addr, direction, hook)
+        self._map_pages(addr >> 8, (addr >> 8) + 1)
+
+    def unwatch(self, addr, direction):
+        super(FlatMMU, self).unwatch(addr, direction)
+        self._map_pages(addr >> 8, (addr >> 8) + 1)
+
+    def _watched_read(self):
+        mem, watched = self.mem, self.rwatch
+        def read(addr):
+            hook = watched.get(addr)
+            if hook is not None:
+                hook(addr, "r")
+            return mem[addr]
+        return read
+
+    def _watched_write(self):
+        mem, watched = self.mem, self.wwatch
+        def write(addr, value, protect_rom=True):
+            hook = watched.get(addr)
+            if hook is not None:
+                hook(addr, "w")
+            mem[addr] = value & 0xff
+        return write
+
+    def reset(self):
+        """
+        In all writeable blocks reset all values to zero.
+        """
+        for b in self.blocks:
+            if not b['readonly']:
+                b['memory'][:] = bytes(b['length'])
+
+    def _load_block(self, b, data):
+        b['memory'][:] = data
+
+    def _page_kind(self, page):
+        lo, hi = page << 8, (page + 1) << 8
+        if self.iopages[page]:
+            return IO_PAGE
+        covered = [b for b in self.blocks if b['start'] < hi and lo < b['start'] + b['length']]
+        if not covered:
+            return UNMAPPED
+        b = covered[0]
+        if len(covered) > 1 or b['start'] > lo or b['start'] + b['length'] < hi:
+            return MIXED_PAGE
+        return ROM_PAGE if b['readonly'] else RAM_PAGE
+
+    def _map_pages(self, lo=0, hi=0x100):
+        """Rebuilds the page table for pages from lo up to hi"""
+        slow_read, slow_write = MMU.read.__get__(self), MMU.write.__get__(self)
+        for page in range(lo, hi):
+            kind = self._page_kind(page)
+            self.pagekind[page] = kind
+            self.rpage[page] = None if kind in (RAM_PAGE, ROM_PAGE) else slow_read
+            self.wpage[page] = None if kind == RAM_PAGE else slow_write
+            if self.rpage[page] is None and any(a >> 8 == page for a in self.rwatch):
+                self.rpage[page] = self._watched_read()
+            if self.wpage[page] is None and any(a >> 8 == page for a in self.wwatch):
+                self.wpage[page] = self._watched_write()
+
+    def write(self, addr, value, protect_rom=True):
+        """
+        Write a value to the given address if it is writeable.
+        """
+        h = self.wpage[addr >> 8]
+        if h is None:
+            self.mem[addr] = value & 0xff
+        else:
+            h(addr, value, protect_rom)
+
+    def read(self, addr):
+        """
+        Return the value at the address.
+        """
+        h = self.rpage[addr >> 8]
+        if h is None:
+            return self.mem[addr]
+        return h(addr)
+
+    def read_range(self, lo, hi):
+        """Returns a read-only view of memory unless IO devices are in range"""
+        self._check_mapped(lo, hi)
+        view = memoryview(self.mem)[lo:hi]
+        if not any(self.iopages[p] & IO_READ for p in range(lo >> 8, ((hi - 1) >> 8) + 1)):
+            return view.toreadonly()
+        return self._peek_io(bytearray(view), lo, hi)
+
+    def __deepcopy__(self, memo):
+        # Blocks hold views into self.mem, these must point to the new copy.
+        new = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new
+        for k, v in self.__dict__.items():
+            if k not in ("blocks", "rpage", "wpage"):
+                setattr(new, k, copy.deepcopy(v, memo))
+        new.blocks = [dict(b, memory=memoryview(new.mem)[b['start']:b['start'] + b['length']])
+                      for b in self.blocks]
+        memo[id(self.blocks)] = new.blocks
+        new.rpage, new.wpage = [None]*0x100, [None]*0x100
+        new._map_pages()
+        return new
@@ -0,0 +1,223 @@
+"""Generates specialized opcode handlers from CPU._ops
+
+Every opcode gets its own plain function with operand fetching and address
+computation written out inline and the cycle count folded into a constant.
+Bodies of the frequent operations (loads, stores, transfers, increments and
+decrements, compares, logic, BIT, JMP, flag changes and ADC/SBC through the
+shared tables) are written out too, so executing one of them is a single
+`ops[opcode](cpu)` call. The rest, shifts, stack and subroutine operations
+and illegal opcodes, still call the CPU method of their operation. Handlers
+are not bound to a CPU: the table is shared by all instances and creating a
+CPU costs nothing.
+
+Generated source is cached on disk in __pycache__/opgen, the file name carries
+a hash of the ops table and of this very file, so a change to either results
+in a fresh module. Python's own bytecode caching takes care of the rest. When
+the cache directory is not writable the module is compiled in memory.
+"""
+import hashlib
+import importlib.util
+import os
+
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__", "opgen")
+
+# In-process caches: hash -> tuple of handlers and id of ops -> (ops, handlers).
+_loaded = {}
+_by_table = {}
+
+# Fetching a byte at PC and moving PC past it.
+FETCH = "read(r.pc)"
+NEXT = "r.pc += 1"
+
+# Lines computing `a`, an effective address, for every addressing mode.
+# Mirrors CPU.*_a methods, including their page crossing penalties.
+ADDRESS = {
+    "z": [f"a = {FETCH}", NEXT],
+    "zx": [f"a = ({FETCH} + r.x) & 0xff", NEXT],
+    "zy": [f"a = ({FETCH} + r.y) & 0xff", NEXT],
+    "a": [f"lo = {FETCH}", NEXT, f"a = ({FETCH} << 8) + lo", NEXT],
+    "ax": [f"lo = {FETCH}", NEXT, f"o = ({FETCH} << 8) + lo", NEXT,
+           "a = o + r.x",
+           "if o // 0xff != a // 0xff:", "    self.cc += 1",
+           "a &= 0xffff"],
+    "ay": [f"lo = {FETCH}", NEXT, f"o = ({FETCH} << 8) + lo", NEXT,
+           "a = o + r.y",
+           "if o // 0xff != a // 0xff:", "    self.cc += 1",
+           "a &= 0xffff"],
+    "i": [f"lo = {FETCH}", NEXT, f"i = ({FETCH} << 8) + lo", NEXT,
+          "j = i - 0xff if i & 0xff == 0xff else i + 1",
+          "a = ((read(j) << 8) + read(i)) & 0xffff"],
+    "ix": [f"i = ({FETCH} + r.x) & 0xff", NEXT,
+           "a = ((read((i + 1) & 0xff) << 8) + read(i)) & 0xffff"],
+    "iy": [f"i = {FETCH}", NEXT,
+           "o = (read((i + 1) & 0xff) << 8) + read(i)",
+           "a = o + r.y",
+           "if o // 0xff != a // 0xff:", "    self.cc += 1",
+           "a &= 0xffff"],
+}
+
+# Flag bits tested by branches, see CPU.branch.
+BRANCH_FLAGS = {'N': 0x80, 'V': 0x40, 'Z': 0x02, 'C': 0x01}
+FLAG_BITS = dict(BRANCH_FLAGS, B=0x10, D=0x08, I=0x04)
+
+# Masks clearing flags an operation sets, see NOT_* in cpu.py.
+NOT_ZN, NOT_ZNC, NOT_ZNV, NOT_ZNCV = 0x7d, 0x7c, 0x3d, 0x3c
+
+# Written at the top of every generated module, same as cpu.ZN_FLAGS.
+PREAMBLE = ["ZN_FLAGS = bytes((0x02 if v == 0 else 0) | (v & 0x80) for v in range(0x100))"]
+
+# Bodies of operations written out inline, mirroring CPU methods of the same
+# name. Operations on a value ("v") get it in `v`, those on an address ("a")
+# get it in `a`, operations with a target in _ops are functions of it.
+OPERATIONS = {
+    "ADC": ["p = r.p",
+            "e = (self.adcDecimal if p & 0x08 else self.adcBinary)"
+            "[(p & 0x01) << 16 | (r.a & 0xff) << 8 | (v & 0xff)]",
+            "r.a = e & 0xff",
+            f"r.p = (p & {NOT_ZNCV:#04x}) | (e >> 8)"],
+    "SBC": ["p = r.p",
+            "if p & 0x08:",
+            "    e = self.sbcDecimal[(p & 0x01) << 16 | (r.a & 0xff) << 8 | (v & 0xff)]",
+            "else:",
+            "    e = self.adcBinary[(p & 0x01) << 16 | (r.a & 0xff) << 8 | (~v & 0xff)]",
+            "r.a = e & 0xff",
+            f"r.p = (p & {NOT_ZNCV:#04x}) | (e >> 8)"],
+    "AND": ["r.a = n = (r.a & v) & 0xff", f"r.p = (r.p & {NOT_ZN:#04x}) | ZN_FLAGS[n]"],
+    "ORA": ["r.a = n = r.a | v", f"r.p = (r.p & {NOT_ZN:#04x}) | ZN_FLAGS[n & 0xff]"],
+    "EOR": ["r.a = n = r.a ^ v", f"r.p = (r.p & {NOT_ZN:#04x}) | ZN_FLAGS[n & 0xff]"],
+    "BIT": [f"r.p = (r.p & {NOT_ZNV:#04x}) | (v & 0xc0) | (0x02 if r.a & v == 0 else 0)"],
+    "INC": ["n = (read(a) + 1) & 0xff", "write(a, n)",
+            f"r.p = (r.p & {NOT_ZN:#04x}) | ZN_FLAGS[n]"],
+    "DEC": ["n = (read(a) - 1) & 0xff", "write(a, n)",
+            f"r.p = (r.p & {NOT_ZN:#04x}) | ZN_FLAGS[n]"],
+    "JMP": ["r.pc = a"],
+    "NOP": [],
+    "T": lambda t: [f"r.{t[1]} = n = r.{t[0]}"] +
+                   ([] if t[1] == "s" else [f"r.p = (r.p & {NOT_ZN:#04x}) | ZN_FLAGS[n & 0xff]"]),
+    "SE": lambda flag: [f"r.p |= {FLAG_BITS[flag]:#04x}"],
+    "CL": lambda flag: [f"r.p &= {0xff ^ FLAG_BITS[flag]:#04x}"],
+}
+for reg in "axy":
+    OPERATIONS[f"LD{reg.upper()}"] = [f"r.{reg} = v", f"r.p = (r.p & {NOT_ZN:#04x}) | ZN_FLAGS[v & 0xff]"]
+    OPERATIONS[f"ST{reg.upper()}"] = [f"write(a, r.{reg})"]
+for reg, op in (("a", "CMP"), ("x", "CPX"), ("y", "CPY")):
+    OPERATIONS[op] = [f"r.p = (r.p & {NOT_ZNC:#04x}) | ZN_FLAGS[(r.{reg} - v) & 0xff]"
+                      f" | (0x01 if v <= r.{reg} else 0)"]
+for reg in "xy":
+    for op, sign in (("IN", "+"), ("DE", "-")):
+        OPERATIONS[f"{op}{reg.upper()}"] = lambda _, reg=reg, sign=sign: [
+            f"r.{reg} = n = (r.{reg} {sign} 1) & 0xff", f"r.p = (r.p & {NOT_ZN:#04x}) | ZN_FLAGS[n]"]
+OPERATIONS["NOP_ip"] = lambda _: []
+
+
+def table_hash(ops):
+    with open(__file__, "rb") as f:
+        source = f.read()
+    return hashlib.sha1(repr(ops).encode() + source).hexdigest()[:16]
+
+
+def handler_body(op, atype, mode, cc, target):
+    """Returns source lines of a handler body for a single ops table entry
+
+    >>> for line in handler_body("LDA", "v", "z", 3, None):
+    ...     print(line)
+    r = self.r
+    read = self.mmu.read
+    a = read(r.pc)
+    r.pc += 1
+    v = read(a)
+    r.a = v
+    r.p = (r.p & 0x7d) | ZN_FLAGS[v & 0xff]
+    self.cc += 3
+
+    Operations which are not in OPERATIONS call the CPU method:
+    >>> handler_body("ASL", "a", "z", 5, None)[-2:]
+    ['self.ASL(a)', 'self.cc += 5']
+    """
+    lines = []
+    inline = OPERATIONS.get(f"{op}_{mode}", OPERATIONS.get(op))
+    if op == "B":
+        flag, expected = target
+        lines += [f"d = {FETCH}", NEXT,
+                  f"if r.p & {BRANCH_FLAGS[flag]:#04x} {'!=' if expected else '=='} 0:",
+                  "    o = r.pc",
+                  "    r.pc = o + (d & 0x7f) - (d & 0x80)",
+                  "    self.cc += 1 if o // 0xff == r.pc // 0xff else 2"]
+    elif target:
+        lines += inline(target) if callable(inline) else [f"self.{op}({target!r})"]
+    elif mode == "im" and atype == "v":
+        lines += [f"v = {FETCH}", NEXT]
+        lines += [f"self.{op}(v)"] if inline is None else inline
+    elif mode in ADDRESS:
+        lines += ADDRESS[mode]
+        if inline is None:
+            lines.append(f"self.{op}(read(a))" if atype == "v" else f"self.{op}(a)")
+        else:
+            lines += (["v = read(a)"] if atype == "v" else []) + inline
+    else:
+        raise ValueError(f"Cannot generate {op} with addressing mode {mode}")
+    if cc:
+        lines.append(f"self.cc += {cc}")
+    prologue = []
+    if any("r." in line for line in lines):
+        prologue.append("r = self.r")
+    if any("read(" in line for line in lines):
+        prologue.append("read = self.mmu.read")
+    if any("write(" in line for line in lines):
+        prologue.append("write = self.mmu.write")
+    return prologue + lines
+
+
+def generate(ops):
+    """Returns source code of a module with handlers for all opcodes in ops"""
+    out = ["# Generated by opgen.py from CPU._ops, do not edit.", ""] + PREAMBLE + [""]
+    names = [None]*0x100
+    for op, atype, addrs in ops:
+        for mode, cc, opcodes, target in addrs:
+            body = handler_body(op, atype, mode, cc, target)
+            for o in opcodes:
+                if names[o]:
+                    raise Exception("Opcode %s already defined" % hex(o))
+                names[o] = f"op_{o:02x}_{op}_{mode}"
+                out.append(f"def {names[o]}(self):")
+                out.extend("    " + line for line in body)
+                out.append("")
+    out.append("OPS = (")
+    out.extend(f"    {name}," for name in names)
+    out.append(")")
+    return "\n".join(out) + "\n"
+
+
+def _load_from_disk(key, ops):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"ops_{key}.py")
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(generate(ops))
+        os.replace(tmp, path)  # Atomic, parallel runs can race here.
+    spec = importlib.util.spec_from_file_location(f"opgen_ops_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.OPS
+
+
+def handlers(ops):
+    """Returns a tuple of 256 handlers (None for undefined opcodes) for ops
+
+    Handlers take a CPU as their only argument.
+    """
+    known = _by_table.get(id(ops))
+    if known is not None and known[0] is ops:
+        return known[1]
+    key = table_hash(ops)
+    if key not in _loaded:
+        try:
+            _loaded[key] = _load_from_disk(key, ops)
+        except OSError:
+            namespace = {}
+            exec(compile(generate(ops), f"<opgen {key}>", "exec"), namespace)
+            _loaded[key] = namespace["OPS"]
+    _by_table[id(ops)] = ops, _loaded[key]
+    return _loaded[key]
@@ -0,0 +1,189 @@
+"""Flat execution profiler
+
+Counts instructions and cycles for every address and every opcode while code
+runs. Counters live in preallocated arrays of 64K and 256 entries, running
+code only increments them. Like tracer.Tracer, Profiler is an execution loop
+of its own which CPU.run uses while a profiler is attached.
+
+Hot addresses are reported grouped into ranges: executed addresses no more
+than an instruction apart belong to the same range, which is usually a loop or
+a straight piece of a routine.
+
+Calls are followed too. JSR and BRK enter a subroutine at the address they jump
+to, RTS and RTI leave it. Every distinct chain of calls is a node of a call
+tree which collects cycles of instructions executed in it, the root of the tree
+is the code which was not called from anywhere. A shadow stack remembers S
+after every call, a return leaves all calls whose return addresses it has
+popped, so code which drops return addresses or returns through pushed
+addresses does not confuse the tree. Cycles of JSR/BRK are counted in the
+caller, of RTS/RTI in the callee.
+"""
+from array import array
+import sys
+
+
+# Longest 6502 instruction, executed addresses closer than this are grouped.
+MAX_INSTRUCTION_LEN = 3
+
+# Opcodes which enter and leave subroutines.
+CALL, RETURN = 1, 2
+FLOW = bytearray(0x100)
+FLOW[0x20] = FLOW[0x00] = CALL  # JSR, BRK
+FLOW[0x60] = FLOW[0x40] = RETURN  # RTS, RTI
+ROOT = 0
+
+
+class Profiler:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.addr_instructions = array('Q', bytes(8*0x10000))
+        self.addr_cycles = array('Q', bytes(8*0x10000))
+        self.op_instructions = array('Q', bytes(8*0x100))
+        self.op_cycles = array('Q', bytes(8*0x100))
+        # Call tree: parents, entry addresses, cycles and calls by node.
+        self.parent, self.entry = [ROOT], [None]
+        self.node_cycles, self.node_calls = [0], [0]
+        self.children = {}  # (parent, entry) -> node
+        self.frames = []  # Shadow stack of (node, S after the call).
+        self.node = ROOT
+
+    def run(self, cpu, limit, max_cycles=sys.maxsize, stops=frozenset()):
+        """Executes and counts up to limit instructions like CPU._runBreak"""
+        r, ops, read = cpu.r, cpu.ops, cpu.mmu.read
+        ai, ac = self.addr_instructions, self.addr_cycles
+        oi, oc = self.op_instructions, self.op_cycles
+        nc, children, frames, node = self.node_cycles, self.children, self.frames, self.node
+        done = cycles = 0
+        try:
+            while done < limit:
+                cpu.cc = 0
+                pc = r.pc
+                opcode = read(pc)
+                r.pc = pc + 1
+                ops[opcode](cpu)
+                cc = cpu.cc
+                ai[pc] += 1
+                ac[pc] += cc
+                oi[opcode] += 1
+                oc[opcode] += cc
+                nc[node] += cc
+                flow = FLOW[opcode]
+                if flow == CALL:
+                    node = children.get((node, r.pc)) or self._add_node(node, r.pc)
+                    self.node_calls[node] += 1
+                    frames.append((node, r.s))
+                elif flow == RETURN:
+                    while frames and frames[-1][1] < r.s:
+                        frames.pop()
+                    node = frames[-1][0] if frames else ROOT
+                cycles += cc
+                done += 1
+                if cycles >= max_cycles or r.pc in stops or not cpu.running:
+                    break
+        except KeyboardInterrupt:
+            cpu.interrupted = True
+        finally:
+            self.node = node
+        return done, cycles
+
+    def _add_node(self, parent, entry):
+        node = len(self.parent)
+        self.parent.append(parent)
+        self.entry.append(entry)
+        self.node_cycles.append(0)
+        self.node_calls.append(0)
+        self.children[(parent, entry)] = node
+        return node
+
+    def _path(self, node):
+        path = []
+        while node != ROOT:
+            path.append(self.entry[node])
+            node = self.parent[node]
+        return path[::-1]
+
+    def totals(self):
+        """Returns (instructions, cycles) counted so far"""
+        return sum(self.op_instructions), sum(self.op_cycles)
+
+    def hotspots(self):
+        """Returns [(lo, hi, instructions, cycles)] address ranges, hottest first
+
+        hi is the last executed address of a range.
+
+        >>> p = Profiler()
+        >>> for addr, cc in ((0xe000, 2), (0xe002, 3), (0xe010, 4)):
+        ...     p.addr_instructions[addr] += 1
+        ...     p.addr_cycles[addr] += cc
+        >>> p.hotspots()
+        [(57344, 57346, 2, 5), (57360, 57360, 1, 4)]
+        """
+        ranges = []
+        ai, ac = self.addr_instructions, self.addr_cycles
+        for addr in (a for a in range(0x10000) if ai[a]):
+            if ranges and addr - ranges[-1][1] <= MAX_INSTRUCTION_LEN:
+                lo, _, n, c = ranges[-1]
+                ranges[-1] = (lo, addr, n + ai[addr], c + ac[addr])
+            else:
+                ranges.append((addr, addr, ai[addr], ac[addr]))
+        return sorted(ranges, key=lambda x: x[3], reverse=True)
+
+    def opcodes(self):
+        """Returns [(opcode, instructions, cycles)] of executed opcodes, hottest first"""
+        found = [(o, self.op_instructions[o], self.op_cycles[o])
+                 for o in range(0x100) if self.op_instructions[o]]
+        return sorted(found, key=lambda x: x[2], reverse=True)
+
+
+    def subroutines(self):
+        """Returns [(entry, calls, inclusive cycles, exclusive cycles)], hottest first
+
+        Inclusive cycles of a recursive subroutine are counted once, at its
+        outermost call.
+        """
+        total = self.node_cycles[:]
+        for node in range(len(total) - 1, ROOT, -1):  # Children come after parents.
+            total[self.parent[node]] += total[node]
+        found = {}
+        for node in range(1, len(total)):
+            entry = self.entry[node]
+            calls, inclusive, exclusive = found.get(entry, (0, 0, 0))
+            if entry not in self._path(self.parent[node]):  # Outermost call.
+                inclusive += total[node]
+            found[entry] = (calls + self.node_calls[node], inclusive,
+                            exclusive + self.node_cycles[node])
+        return sorted(((e, *v) for e, v in found.items()), key=lambda x: x[2], reverse=True)
+
+    def collapsed(self):
+        """Yields lines of collapsed stacks, as flame graph tools expect them
+
+        >>> p = Profiler()
+        >>> inner = p._add_node(p._add_node(ROOT, 0xe010), 0xe020)
+        >>> p.node_cycles[ROOT], p.node_cycles[inner] = 10, 4
+        >>> list(p.collapsed())
+        ['root 10', 'root;e010;e020 4']
+        """
+        for node, cycles in enumerate(self.node_cycles):
+            if cycles:
+                yield ";".join(["root"] + [f"{a:04x}" for a in self._path(node)]) + f" {cycles}"
+
+
+def format_report(profiler, num=10, names=None):
+    """Returns lines of text with totals, num hottest ranges and opcodes"""
+    instructions, cycles = profiler.totals()
+    lines = [f"profiled: {instructions} instructions, {cycles} cycles"]
+    percent = lambda c: f"{100*c/cycles:5.1f}%" if cycles else "  0.0%"
+    lines.append(f"{'addresses':9} {'instrs':>10} {'cycles':>11}  share")
+    for lo, hi, n, c in profiler.hotspots()[:num]:
+        where = f"{lo:04x}-{hi:04x}" if hi != lo else f"{lo:04x}     "
+        lines.append(f"{where} {n:>10} {c:>11} {percent(c)}")
+    lines.append(f"{'opcode':9} {'instrs':>10} {'cycles':>11}  share")
+    for o, n, c in profiler.opcodes()[:num]:
+        name = (names or {}).get(o) or "???"
+        lines.append(f"{o:02x} {name:6} {n:>10} {c:>11} {percent(c)}")
+    lines.append(f"{'routine':9} {'calls':>10} {'inclusive':>11} {'exclusive':>11}")
+    for entry, calls, inclusive, exclusive in profiler.subroutines()[:num]:
+        lines.append(f"{entry:04x}      {calls:>10} {inclusive:>11} {exclusive:>11}")
+    return lines
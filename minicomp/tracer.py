@@ -0,0 +1,126 @@
+"""Execution trace recorder
+
+Every executed instruction becomes a fixed-width binary record in a ring
+buffer: PC, opcode, A, X, Y, S and P as they were before the instruction and
+the number of cycles it took. Records are packed straight into a preallocated
+bytearray, nothing is formatted until somebody looks at the trace.
+
+When a file is given, the buffer is appended to a gzip stream every time it
+fills up (and once more on close), so the file holds every record of a run of
+any length while memory use stays fixed. `read_trace` reads such files back.
+
+Tracing is an execution engine of its own: CPU.run uses Tracer.run instead of
+its usual loop while a tracer is attached, so there is no cost when tracing is
+off. Traced runs always execute instruction by instruction, the block cache is
+not used.
+"""
+import gzip
+import struct
+import sys
+
+from blockcache import decode_table
+
+
+# pc opcode a x y s p cycles
+RECORD = struct.Struct("<HBBBBBBB")
+CYCLES_OFFSET = RECORD.size - 1
+DEFAULT_SIZE = 0x10000
+
+
+# Branches are a single operation in CPU._ops, see CPU.branch.
+BRANCH_NAMES = {
+    ('N', False): "BPL", ('N', True): "BMI", ('V', False): "BVC", ('V', True): "BVS",
+    ('C', False): "BCC", ('C', True): "BCS", ('Z', False): "BNE", ('Z', True): "BEQ",
+}
+
+
+def opcode_names(ops):
+    """Returns a dict of mnemonics by opcode for CPU._ops
+
+    >>> ops = [("B", "v", [("im", 2, [0x10], ('N', False))]), ("NOP", "", [("", 2, [0xea], None)])]
+    >>> opcode_names(ops)
+    {16: 'BPL', 234: 'NOP'}
+    """
+    return {o: BRANCH_NAMES[d.target] if d.op == "B" else d.op
+            for o, d in enumerate(decode_table(ops)) if d is not None}
+
+
+def format_record(record, names=None):
+    """Returns a line of text for a record, names maps opcodes to mnemonics
+
+    >>> format_record((0xe000, 0xa9, 0, 1, 2, 0xff, 0x24, 2), {0xa9: "LDA"})
+    'e000 a9 LDA A:00 X:01 Y:02 S:ff P:24 2'
+    """
+    pc, opcode, a, x, y, s, p, cc = record
+    name = (names or {}).get(opcode) or "???"
+    return f"{pc:04x} {opcode:02x} {name:3} A:{a:02x} X:{x:02x} Y:{y:02x} S:{s:02x} P:{p:02x} {cc}"
+
+
+def read_trace(fname):
+    """Yields records from a file written by a Tracer"""
+    with gzip.open(fname, "rb") as f:
+        while True:
+            chunk = f.read(RECORD.size * 4096)
+            if not chunk:
+                return
+            yield from RECORD.iter_unpack(chunk)
+
+
+class Tracer:
+    """Records instructions into a ring buffer of size records"""
+
+    def __init__(self, size=DEFAULT_SIZE, fname=None):
+        self.size = size
+        self.buf = bytearray(size * RECORD.size)
+        self.count = 0  # Records made so far, including overwritten ones.
+        self.fname = fname
+        self.stream = gzip.open(fname, "wb") if fname is not None else None
+
+    def run(self, cpu, limit, max_cycles=sys.maxsize, stops=frozenset()):
+        """Executes and records up to limit instructions like CPU._runBreak"""
+        r, ops, read = cpu.r, cpu.ops, cpu.mmu.read
+        pack, buf, end = RECORD.pack_into, self.buf, len(self.buf)
+        ofs = (self.count % self.size) * RECORD.size
+        done = cycles = 0
+        try:
+            while done < limit:
+                cpu.cc = 0
+                pc = r.pc
+                opcode = read(pc)
+                pack(buf, ofs, pc, opcode, r.a, r.x, r.y, r.s, r.p, 0)
+                r.pc = pc + 1
+                ops[opcode](cpu)
+                buf[ofs + CYCLES_OFFSET] = cpu.cc
+                ofs += RECORD.size
+                if ofs == end:
+                    if self.stream is not None:
+                        self.stream.write(buf)
+                    ofs = 0
+                cycles += cpu.cc
+                done += 1
+                if cycles >= max_cycles or r.pc in stops or not cpu.running:
+                    break
+        except KeyboardInterrupt:
+            cpu.interrupted = True
+        finally:
+            self.count += done
+        return done, cycles
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def records(self, n=None):
+        """Returns up to n (all by default) latest records, oldest first"""
+        n = len(self) if n is None else min(n, len(self))
+        return [RECORD.unpack_from(self.buf, ((self.count - n + i) % self.size) * RECORD.size)
+                for i in range(n)]
+
+    def close(self):
+        """Writes records not streamed yet and closes the file"""
+        if self.stream is None:
+            return
+        tail = self.count % self.size
+        if tail:
+            self.stream.write(memoryview(self.buf)[:tail * RECORD.size])
+        self.stream.close()
+        self.stream = None
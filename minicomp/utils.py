@@ -36,6 +36,15 @@ def to_int(_, x):
     raise ValueError("Requires a string-like object")
 
 
+def to_count(_, x):
+    """to_int for counts which may be left out with "until" instead
+
+    >>> to_count(None, "10"), to_count(None, "until")
+    (10, None)
+    """
+    return None if x == "until" else to_int(_, x)
+
+
 # TODO: does this belong here?
 def substitute_pc(other, x):
     """Replaces "pc" with an address pointed to by PC"""
@@ -124,6 +133,22 @@ def byte_to_repr(val, asascii=False):
     return byte(val)
 
 
+# Representations of every byte value, see `bytes_to_reprs`.
+HEX_REPRS = tuple(byte_to_repr(v) for v in range(0x100))
+ASCII_REPRS = tuple(byte_to_repr(v, asascii=True) for v in range(0x100))
+
+
+def bytes_to_reprs(data, asascii=False):
+    """byte_to_repr for every byte of data at once, returns a list
+
+    >>> bytes_to_reprs(b"a\\n\\x08")
+    ['61', '0a', '08']
+    >>> bytes_to_reprs(b"a\\n\\x08", asascii=True)
+    [' a', '\\\\n', '08']
+    """
+    return list(map(ASCII_REPRS.__getitem__ if asascii else HEX_REPRS.__getitem__, data))
+
+
 # TODO: does this belong here?
 def mem_element(mem, addr, asascii=False):
     try:
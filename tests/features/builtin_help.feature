@@ -11,8 +11,9 @@ Scenario: a user wants to list all accessible commands
 	Then they do not get an error
 	And  the follwoing commands are listed
 	"""
-	addinpt ascii clrkbd ctxt dump exefile help patch read
-	reload reset showkbd signed step write
+	addinpt ascii break clrkbd ctxt delete dump engine exefile flamegraph
+	help patch profile read reload reset run showkbd showtrace signed step
+	trace watch write
 	"""
 
 
@@ -28,16 +29,25 @@ Examples:
 	| command	|
 	| addinpt	|
 	| ascii		|
+	| break		|
 	| clrkbd	|
 	| ctxt		|
+	| delete	|
 	| dump		|
+	| engine	|
 	| exefile	|
+	| flamegraph	|
 	| help		|
 	| patch		|
+	| profile	|
 	| read		|
 	| reload	|
 	| reset		|
+	| run		|
 	| showkbd	|
+	| showtrace	|
 	| signed	|
 	| step		|
+	| trace		|
+	| watch		|
 	| write		|
@@ -20,9 +20,28 @@ Scenario: a user can patch ROM from file without resetting emulator state
 	And RAM is unchanged
 
 
+Scenario: patching ROM reports changed address ranges
+	When a user enters "patch empty.bin"
+	Then they see "changed: e000-e005, e007-e00b, e00d, e010-e012, fffd"
+
+
+Scenario: patching ROM with the same image changes nothing
+	When a user enters "patch echo.bin"
+	Then they see "unchanged"
+	And  ROM is unchanged
+
+
 Scenario: a user can reinitialize the emulator with a different binary
 	When a user does some interaction with the emulator
 	And  a user enters "reload empty.bin"
 	Then ROM is new
 	And CPU is in initial state
 	And RAM is cleared
+
+
+Scenario: a snapshot brings back registers, counters and memory
+	When a user does some interaction with the emulator
+	And  the emulator state is saved
+	And  a user enters "run 1000"
+	And  the saved emulator state is restored
+	Then the emulator is in the saved state
@@ -0,0 +1,55 @@
+Feature: running code could be stopped at breakpoints and watched addresses
+
+Background: console with a basic program exists
+	Given console is initiated
+
+
+Scenario Outline: a user runs code until a breakpoint
+	When a user enters "engine <engine>"
+	And  a user enters "break 0xe010"
+	And  a user enters "run"
+	Then they see "break: 4 instructions, 16 cycles"
+Examples:
+	| engine	|
+	| step		|
+	| blocks	|
+
+
+Scenario Outline: a user runs code until a watched address is accessed
+	When a user enters "watch <addr> <direction>"
+	And  a user enters "run"
+	Then they see "<result>"
+Examples:
+	| addr	| direction	| result					|
+	| 0x10	| w		| watch: 5 instructions, 21 cycles, write to 0010	|
+	| 0x401	| r		| watch: 1 instructions, 4 cycles, read of 0401		|
+
+
+Scenario Outline: a user steps over a breakpoint or a watched address
+	When a user enters "<command>"
+	And  a user enters "step 10"
+	Then they see "<result>"
+Examples:
+	| command	| result					|
+	| break 0xe010	| break: 4 instructions, 16 cycles		|
+	| watch 0x10	| watch: 5 instructions, 21 cycles, write to 0010	|
+
+
+Scenario: a user lists breakpoints and watchpoints
+	When a user enters "break 0xe010"
+	And  a user enters "watch 0x10"
+	And  a user enters "reset"
+	And  a user enters "break"
+	Then they see
+		"""
+		break e010
+		watch 0010 w
+		"""
+
+
+Scenario: a user deletes all breakpoints and watchpoints
+	When a user enters "break 0xe010"
+	And  a user enters "watch 0x10"
+	And  a user enters "delete"
+	And  a user enters "run 1000"
+	Then they see "instructions: 1000 instructions, 3583 cycles"
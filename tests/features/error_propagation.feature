@@ -13,11 +13,16 @@ Examples:
 	| ctxt	   |          	  |
 	| dump	   |          	  |
 	| dump	   | 0 		  |
+	| engine   |          	  |
 	| exefile  |          	  |
+	| flamegraph |        	  |
 	| patch	   |          	  |
+	| profile  |          	  |
 	| read	   |          	  |
 	| reload   |          	  |
 	| signed   |          	  |
+	| watch    |          	  |
+	| trace    |          	  |
 	| write	   |          	  |
 	| write	   | 0 		  |
 
@@ -38,9 +43,13 @@ Examples:
 	| ascii	   | 0.6        	  | E: unknown value		|
 	| ascii	   | ab 	       	  | E: unknown value		|
 	| ascii	   | 127        	  | E: unknown value		|
+	| break    | foo		  | E: not a number		|
+	| break    | 65536		  | E: impossible address	|
 	| ctxt	   | -1          	  | E: impossible address 	|
 	| ctxt	   | 65536          	  | E: impossible address 	|
 	| ctxt	   | foo          	  | E: not a number 		|
+	| delete   | foo		  | E: not a number		|
+	| delete   | 0x1234		  | E: nothing to delete	|
 	| dump	   | s 1          	  | E: not a number 		|
 	| dump	   | 1 s          	  | E: not a number 		|
 	| dump	   | s s          	  | E: not a number 		|
@@ -48,7 +57,17 @@ Examples:
 	| dump	   | -1 0          	  | E: impossible loaddr	|
 	| dump	   | 0 -1          	  | E: impossibe hiaddr		|
 	| dump	   | 0 65536          	  | E: impossible hiaddr	|
+	| engine   | foo		  | E: unknown engine		|
 	| exefile  | quuxmeepfoobar324	  | E: cannot read file		|
+	| exefile  | main.py loud	  | E: expected quiet or strict	|
+	| flamegraph | stacks.txt	  | E: profiling is off		|
+	| run 	   | 0			  | E: cannot make less than...	|
+	| run 	   | -1			  | E: cannot make less than...	|
+	| run 	   | foo		  | E: invalid number of...	|
+	| run 	   | until		  | E: missing address		|
+	| run 	   | 10 foo		  | E: not a number		|
+	| run 	   | 10 -1		  | E: impossible address	|
+	| run 	   | 10 65536		  | E: impossible address	|
 	| step 	   | 0			  | E: cannot make less than...	|
 	| step 	   | -1			  | E: cannot make less than...	|
 	| step 	   | 1000001		  | E: too many steps		|
@@ -66,6 +85,17 @@ Examples:
 	| signed   | foo		  | E: not a number		|
 	| signed   | -1			  | E: impossible value		|
 	| signed   | 256		  | E: impossible value		|
+	| profile  | foo		  | E: expected on, off or show	|
+	| profile  | show		  | E: profiling is off		|
+	| profile  | show 0		  | E: cannot show less than...	|
+	| profile  | show foo		  | E: not a number		|
+	| showtrace| 0		  | E: cannot show less than...	|
+	| showtrace| foo		  | E: not a number		|
+	| trace    | foo		  | E: expected on or off	|
+	| trace    | on /nonexistent/dir/trace.gz | E: cannot write file	|
+	| watch    | foo		  | E: not a number		|
+	| watch    | -1		  | E: impossible address	|
+	| watch    | 0x10 x		  | E: expected r or w		|
 	| reload   | quuxmeepfoobar324	  | E: cannotread file		|
 	| patch	   | quuxmeepfoobar324	  | E: cannotread file		|
 
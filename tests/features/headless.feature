@@ -0,0 +1,48 @@
+Feature: ROMs can be run without a terminal
+
+
+Scenario Outline: a ROM is run headless with keyboard input
+	When "echo.bin" is run headless with input "<input>" for "20000" cycles
+	Then the run stops because of "cycles"
+	And  the screen output is "<input>"
+Examples:
+	| input	|
+	| hello	|
+	| 	|
+
+
+Scenario: a ROM is run headless from the command line
+	When "python -m minicomp run" is started for "echo.bin" with input "hello" for "20000" cycles
+	Then it exits successfully and the screen file holds "hello"
+	And  curses is not imported
+
+
+Scenario: jobs of a manifest are run in parallel
+	Given a manifest with jobs running "echo.bin" for "20000" cycles
+		| input	| expected	|
+		| hello	| hello		|
+		| hi	| nope		|
+		| hi	| hi		|
+	When the manifest is run in batch with "2" workers
+	Then every job reports its stop reason and counts
+	And  jobs on lines "1, 3" pass and jobs on lines "2" fail
+
+
+Scenario: a manifest job without a ROM is reported with its line
+	Given a manifest with lines
+		"""
+		{"rom": "echo.bin", "cycles": 20000}
+		{"input": "in.txt", "cycles": 20000}
+		"""
+	When the manifest is read
+	Then reading fails with "manifest:2: job has no rom"
+
+
+Scenario: a manifest job without a budget is reported with its line
+	Given a manifest with lines
+		"""
+		{"rom": "echo.bin", "instructions": 1000}
+		{"rom": "echo.bin", "input": "in.txt"}
+		"""
+	When the manifest is read
+	Then reading fails with "manifest:2: job has no cycles or instructions budget"
@@ -0,0 +1,35 @@
+Feature: keyboard device is fed with input for the program
+
+
+Background: console with basic program exists
+	Given console is initiated
+	When a user enters "clrkbd"
+
+
+Scenario: a user adds input to the keyboard
+	When a user enters "addinpt Hi there"
+	And a user enters "addinpt !"
+	And a user enters "showkbd"
+	Then they see "Hi there!"
+	And the keyboard gives "Hi there!" and then zeroes
+
+
+Scenario: a user cleans the keyboard
+	When a user enters "addinpt Hi"
+	And a user enters "clrkbd"
+	And a user enters "showkbd"
+	Then they see ""
+	And the keyboard gives "" and then zeroes
+
+
+Scenario: a user streams a file to the keyboard
+	Given a file holding "from file"
+	When a user enters "addinpt >"
+	And a user streams the file to the keyboard
+	And a user enters "addinpt <"
+	Then the keyboard gives ">from file<" and then zeroes
+
+
+Scenario: a user streams a file which does not exist
+	When a user enters "addinpt </nonexistent/input.txt"
+	Then they get an error
@@ -0,0 +1,32 @@
+Feature: cycles spent by code could be profiled
+
+Background: console with a basic program exists
+	Given console is initiated
+
+
+Scenario: a user profiles a run
+	When a user enters "profile on"
+	And  a user enters "run 1000"
+	And  a user enters "profile show 3"
+	Then they see a profile of "1000" instructions with "3" hottest address ranges, opcodes and routines
+
+
+Scenario: profiling does not change execution
+	When a user enters "profile on"
+	And  a user enters "step 1000"
+	Then PC is the same as after "1000" steps with the default engine
+
+
+Scenario: a user cannot trace and profile at once
+	When a user enters "profile on"
+	And  a user enters "trace on"
+	Then they get an error
+
+
+Scenario: a user profiles nested subroutine calls
+	Given a ROM calling a subroutine which calls another one is loaded
+	When a user enters "profile on"
+	And  a user enters "run 500"
+	And  a user saves the flame graph
+	Then the flame graph has "9" cycles in the root, "12" in "e010" and "6" in "e010;e020" per loop
+	And  subroutine "e010" has "18" inclusive and "12" exclusive cycles per loop
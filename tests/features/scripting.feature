@@ -0,0 +1,52 @@
+Feature: a user runs scripts of commands
+
+
+Background: console with basic program exists
+	Given console is initiated
+	And   a script
+		"""
+		step
+		step 0
+		step 2
+		"""
+
+
+Scenario: a user runs a script
+	When a user runs the script
+	Then they see
+		"""
+		..>step
+		..>step 0
+		..>step 2
+		"""
+	And  "3" instructions are executed
+
+
+Scenario: a user runs a script quietly
+	When a user runs the script "quiet"
+	Then they see ""
+	And  "3" instructions are executed
+
+
+Scenario: a user runs a script which stops on the first error
+	When a user runs the script "strict"
+	Then they see
+		"""
+		..>step
+		..>step 0
+		E: cannot make less than one step (line 2)
+		"""
+	And  "1" instructions are executed
+
+
+Scenario: a user runs a script quietly which stops on the first error
+	When a user runs the script "quiet strict"
+	Then they see "E: cannot make less than one step (line 2)"
+	And  "1" instructions are executed
+
+
+Scenario: script output goes to the console line by line
+	Given output of long commands goes to a list
+	When a user runs the script
+	Then they see ""
+	And  the list holds "..>step", "..>step 0" and "..>step 2"
@@ -30,3 +30,71 @@ Examples:
 Scenario: a user requests too many steps
 	When a user enters "step 1000001"
 	Then  no instructions are executed
+
+
+Scenario Outline: a user steps through code with predecoded blocks
+	When a user enters "engine blocks"
+	And  a user enters "step <k>"
+	Then they do not get an error
+	And  PC is the same as after "<k>" steps with the default engine
+Examples:
+	| k	|
+	| 1	|
+	| 10	|
+	| 1000	|
+
+
+Scenario Outline: a user runs a batch of instructions
+	When a user enters "run <k>"
+	Then they do not get an error
+	And  "<k>" instructions are executed
+Examples:
+	| k	|
+	| 10	|
+	| 1000	|
+
+
+Scenario: a user runs code until it comes back to the current address
+	When a user enters "run 100000 pc"
+	Then they do not get an error
+	And  the CPU stops at the initial address or runs out of budget
+
+
+Scenario: a user runs code until an address without a budget
+	When a user enters "run until 0xe010"
+	Then they see "pc: 4 instructions, 16 cycles"
+
+
+Scenario Outline: the CPU counts instructions and cycles of all runs
+	When a user enters "engine <engine>"
+	And  a user runs "<k>" instructions "3" times
+	Then the CPU has counted "<total>" instructions and all cycles of the runs
+Examples:
+	| engine	| k	| total	|
+	| step		| 1	| 3	|
+	| step		| 500	| 1500	|
+	| blocks	| 500	| 1500	|
+
+
+Scenario Outline: Ctrl-C in the middle of a block is counted like with single steps
+	When a user enters "engine <engine>"
+	And  a user enters "addinpt a"
+	And  Ctrl-C is pressed when address "0x1fe" is read
+	And  a user runs "100" instructions "1" times
+	Then they see "interrupted: 5 instructions, 21 cycles"
+	And  the CPU has counted "5" instructions and all cycles of the runs
+Examples:
+	| engine	|
+	| step		|
+	| blocks	|
+
+
+Scenario Outline: observers are notified at the granularity they subscribed to
+	Given an observer subscribed to "<every>"
+	When a user runs "1000" instructions "2" times
+	Then the observer is notified "<times>"
+Examples:
+	| every		| times			|
+	| instruction	| once per instruction	|
+	| end		| once per run		|
+	| 100		| once per 100 cycles	|
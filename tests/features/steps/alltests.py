@@ -1,14 +1,17 @@
-from copy import deepcopy
 from functools import reduce
 from operator import add
+import os
+import tempfile
 
 from behave import *
 
+from minicomp import tracer
+
 
 @when(u'a user enters "{command}"')
 def step_impl(context, command):
     context.command = command
-    context.emu_state = deepcopy(context.console.c)
+    context.emu_state = context.console.c.snapshot()
     context.command_run_result = context.console.process(command.split(" ", 1))
 
 
@@ -72,6 +75,33 @@ def step_impl(context, k):
     assert len(read_calls) <= 4*k, (f"Expected at most {4*k} memory reads, "
                                     f"got {len(read_calls)}")
 
+
+@then(u'PC is the same as after "{k}" steps with the default engine')
+def step_impl(context, k):
+    reference = context.console.__class__(screen=context.console.screen,
+                                          cpumonitor=context.console.cpumonitor)
+    reference.process(["step", k])
+    expected, actual = reference.c.r, context.console.c.r
+    msg = f"Engines disagree after {k} steps:\nExpected - {expected}\nReceived - {actual}"
+    assert repr(expected) == repr(actual), msg
+
+@then(u'the CPU stops at the initial address or runs out of budget')
+def step_impl(context):
+    reason = context.command_run_result.split(":")[0]
+    assert reason in ("pc", "instructions"), f"Unexpected stop: {context.command_run_result}"
+    if reason == "pc":
+        msg = f"Stopped at {context.console.c.r.pc}, expected {context.emu_state.r.pc}"
+        assert context.console.c.r.pc == context.emu_state.r.pc, msg
+
+@then(u'they see')
+@then(u'they see "{output}"')
+@then(u'they see ""')
+def step_impl(context, output=None):
+    output = (context.text or "") if output is None else output
+    msg = f"Running /{context.command}/ resulted in {context.command_run_result}, expected {output}"
+    assert context.command_run_result == output, msg
+
+
 # TODO: --- helper_functions.py
 @then(u'they receive "{resval}" value of k')
 def step_impl(context, resval):
@@ -103,6 +133,23 @@ def step_impl(context):
             ''')
 
 
+@when(u'the emulator state is saved')
+def step_impl(context):
+    context.saved_state = context.console.c.snapshot()
+
+
+@when(u'the saved emulator state is restored')
+def step_impl(context):
+    context.console.c.restore(context.saved_state)
+
+
+@then(u'the emulator is in the saved state')
+def step_impl(context):
+    state = context.console.c.snapshot()
+    assert state.instructions > 0, f"Nothing was counted before saving: {state}"
+    assert state == context.saved_state, f"Got {state[:-1]}, saved {context.saved_state[:-1]}"
+
+
 @then(u'CPU is in initial state')
 def step_impl(context):
     msg = f"Expected to see PC on the start position, but got {context.console.c.r.pc}"
@@ -119,16 +166,16 @@ def step_impl(context):
     assert context.console.c.r.s == 0xff, msg
 
 
-def mem_blocks(readonly, device):
-    return [b for b in device.mmu.blocks if b["readonly"] == readonly]
+def mem_blocks(readonly, snapshot):
+    return [b for b in snapshot.memory if b.readonly == readonly]
 
 
-def rom_blocks(device):
-    return mem_blocks(True, device)
+def rom_blocks(snapshot):
+    return mem_blocks(True, snapshot)
 
 
-def ram_blocks(device):
-    return mem_blocks(False, device)
+def ram_blocks(snapshot):
+    return mem_blocks(False, snapshot)
 
 
 def has_identical_counterpart(block, other_blocks):
@@ -148,7 +195,7 @@ def find_mismatching_blocks(old_rom_blocks, new_rom_blocks):
 def step_impl(context):
 
     old_rom_blocks = rom_blocks(context.emu_state)
-    new_rom_blocks = rom_blocks(context.console.c)
+    new_rom_blocks = rom_blocks(context.console.c.snapshot())
     msg = (f"ROM blocks number mismatch after running /{context.command}/:\n"
            f"{len(old_rom_blocks)=}\n"
            f"{len(new_rom_blocks)=}"
@@ -157,17 +204,17 @@ def step_impl(context):
 
     mismatching_blocks = find_mismatching_blocks(old_rom_blocks, new_rom_blocks)
     all_blocks_match = not mismatching_blocks
-    msg = f"Some ROM blocks changed: {', '.join(b['start'] for b in mismatching_blocks)}"
+    msg = f"Some ROM blocks changed: {', '.join(hex(b.start) for _, b in mismatching_blocks)}"
     assert all_blocks_match, msg
 
 
 @then(u'RAM is cleared')
 def step_impl(context):
-    new_ram_blocks = ram_blocks(context.console.c)
-    non_empty_blocks = [b for b in new_ram_blocks if any(b["memory"])]
+    new_ram_blocks = ram_blocks(context.console.c.snapshot())
+    non_empty_blocks = [b for b in new_ram_blocks if any(b.memory)]
     all_blocks_are_empty = not non_empty_blocks
     msg = (f"These memory blocks are not empty: "
-           f"{', '.join(b['start'] for b in non_empty_blocks)}")
+           f"{', '.join(hex(b.start) for b in non_empty_blocks)}")
 
     assert all_blocks_are_empty, msg
 
@@ -175,7 +222,7 @@ def step_impl(context):
 @then(u'ROM is new')
 def step_impl(context):
     old_rom_blocks = rom_blocks(context.emu_state)
-    new_rom_blocks = rom_blocks(context.console.c)
+    new_rom_blocks = rom_blocks(context.console.c.snapshot())
     mismatching_blocks = find_mismatching_blocks(old_rom_blocks, new_rom_blocks)
     rom_changed = len(mismatching_blocks) >= 1
     assert rom_changed, "ROM was supposed to change, but it did not"
@@ -198,10 +245,10 @@ def step_impl(context):
 @then(u'RAM is unchanged')
 def step_impl(context):
     old_ram_blocks = ram_blocks(context.emu_state)
-    new_ram_blocks = ram_blocks(context.console.c)
+    new_ram_blocks = ram_blocks(context.console.c.snapshot())
     mismatching_blocks = find_mismatching_blocks(old_ram_blocks, new_ram_blocks)
     all_ram_blocks_match = not mismatching_blocks
-    msg = f"Some RAM blocks changed: {', '.join(b['start'] for b in mismatching_blocks)}"
+    msg = f"Some RAM blocks changed: {', '.join(hex(b.start) for _, b in mismatching_blocks)}"
     assert all_ram_blocks_match, msg
 
 
@@ -234,12 +281,23 @@ def not_empty(iterable):
         return False
 
 
+def table(spans):
+    """Splits text of dump/ctxt spans into lists of words separated by newlines"""
+    text = "".join(span if isinstance(span, str) else span[0] for span in spans)
+    output = []
+    for line in text.split("\n"):
+        if output:
+            output.append("\n")
+        output.append(line.split(" "))
+    return output
+
+
 @then(u'a table view of {lo}:{hi} region of memory is returned')
 def step_impl(context, lo, hi):
     # TODO: split this one. It also does not fully check the layout now.
     lo = int(lo, 16)
     hi = int(hi, 16)
-    output = context.command_run_result
+    output = table(context.command_run_result)
     output = [[x for x in y if not_empty(x)] for y in output if not_empty(y)]
     expected_total = hi - lo
     # There are len(output) addresses in the resulting string.
@@ -281,7 +339,7 @@ def step_impl(context):
 
 @then(u'the table view contains three memory lines')
 def step_impl(context):
-    assert len([x for x in context.command_run_result if x != '\n']) == 3, f"Unexpected number of lines {context.command_run_result}"
+    assert len([x for x in table(context.command_run_result) if x != '\n']) == 3, f"Unexpected number of lines {context.command_run_result}"
 
 @then(u'the first element of middle line is the value at {address}')
 def step_impl(context, address):
@@ -303,7 +361,7 @@ def step_impl(context, number):
         number = 2
     else:
         raise Exception(f"This was not supposed to happen, but got {number=}")
-    output = filter_newlines(context.command_run_result)
+    output = filter_newlines(table(context.command_run_result))
     line = [x for x in output[number] if not_empty(x)]
     addr, *vals = line
     assert len(vals) == 8, f"Expected 8 elements per line, but got {len(vals)}"
@@ -318,7 +376,7 @@ def step_impl(context, outrange_repr):
         if addr > 0xffff or addr < 0:
             return val == rpr
         return True
-    output = filter_newlines(context.command_run_result)
+    output = filter_newlines(table(context.command_run_result))
     target_address = int(output[1][0].rstrip(), 16)
     shown_bytes = reduce(add, [list(filter(not_empty, x))[1:] for x in output])
     byte_addr = list(enumerate(shown_bytes, target_address - 8))
@@ -338,7 +396,7 @@ def step_impl(context, unmapped_repr):
         except IndexError:
             return val == rpr
         return True
-    output = filter_newlines(context.command_run_result)
+    output = filter_newlines(table(context.command_run_result))
     target_address = int(output[1][0].rstrip(), 16)
     shown_bytes = reduce(add, [list(filter(not_empty, x))[1:] for x in output])
     byte_addr = list(filter_outranges(enumerate(shown_bytes, target_address - 8)))
@@ -347,7 +405,7 @@ def step_impl(context, unmapped_repr):
 
 @then(u'addresses outside the range are represented as {outaddr_repr}')
 def step_impl(context, outaddr_repr):
-    output = filter_newlines(context.command_run_result)
+    output = filter_newlines(table(context.command_run_result))
     for idx, line in enumerate(output):
         if not line[0].strip().isalnum():
             if idx == 0 or idx == 2:
@@ -356,3 +414,175 @@ def step_impl(context, outaddr_repr):
                 assert line[0].startswith(outaddr_repr), msg
             else:
                 raise Exception(f"Middle line address is broken: {line[0]}")
+
+
+# TODO: --- tracing.py
+@then(u'they see the last "{n:d}" of "{k:d}" executed instructions')
+def step_impl(context, n, k):
+    lines = context.command_run_result.split("\n")
+    assert len(lines) == n, f"Expected {n} records, got:\n{context.command_run_result}"
+    reference = context.console.__class__(screen=context.console.screen,
+                                          cpumonitor=context.console.cpumonitor)
+    reference.process(["step", str(k - n)])
+    for line in lines:
+        msg = f"Expected PC {hex(reference.c.r.pc)} in {line}"
+        assert int(line.split(" ")[0], 16) == reference.c.r.pc, msg
+        reference.process(["step"])
+
+
+@then(u'they see a profile of "{n:d}" instructions with "{k:d}" hottest address ranges, opcodes and routines')
+def step_impl(context, n, k):
+    lines = context.command_run_result.split("\n")
+    assert lines[0].startswith(f"profiled: {n} instructions, "), lines[0]
+    cycles = int(lines[0].split(", ")[1].split(" ")[0])
+    sections = []
+    for line in lines[1:]:
+        if line.split()[0] in ("addresses", "opcode", "routine"):
+            sections.append([])
+        else:
+            sections[-1].append(line)
+    assert len(sections) == 3, context.command_run_result
+    for rows in sections:
+        section = "\n".join(rows)
+        assert 1 <= len(rows) <= k, f"Expected up to {k} rows:\n{section}"
+        counts = [int(row.split()[-2]) for row in rows]
+        assert counts == sorted(counts, reverse=True), f"Not sorted:\n{section}"
+        assert counts[0] <= cycles
+
+
+@given(u'a ROM calling a subroutine which calls another one is loaded')
+def step_impl(context):
+    rom = bytearray(0x2000)
+    rom[0x00:0x06] = bytes((0x20, 0x10, 0xe0, 0x4c, 0x00, 0xe0))  # JSR e010, JMP e000
+    rom[0x10:0x14] = bytes((0x20, 0x20, 0xe0, 0x60))  # JSR e020, RTS
+    rom[0x20] = 0x60  # RTS
+    fname = os.path.join(tempfile.mkdtemp(), "calls.bin")
+    with open(fname, "wb") as f:
+        f.write(rom)
+    context.execute_steps(f'When a user enters "reload {fname}"')
+    context.loops = 100  # A loop is 5 instructions.
+
+
+@when(u'a user saves the flame graph')
+def step_impl(context):
+    context.flamegraph = os.path.join(tempfile.mkdtemp(), "stacks.txt")
+    context.execute_steps(f'When a user enters "flamegraph {context.flamegraph}"')
+    with open(context.flamegraph) as f:
+        context.stacks = dict(line.rsplit(" ", 1) for line in f.read().splitlines())
+
+
+@then(u'the flame graph has "{root:d}" cycles in the root, "{outer:d}" in "{outer_stack}" and "{inner:d}" in "{inner_stack}" per loop')
+def step_impl(context, root, outer, outer_stack, inner, inner_stack):
+    expected = {"root": root * context.loops, f"root;{outer_stack}": outer * context.loops,
+                f"root;{inner_stack}": inner * context.loops}
+    actual = {k: int(v) for k, v in context.stacks.items()}
+    assert actual == expected, f"Expected {expected}, got {actual}"
+
+
+@then(u'subroutine "{entry}" has "{inclusive:d}" inclusive and "{exclusive:d}" exclusive cycles per loop')
+def step_impl(context, entry, inclusive, exclusive):
+    for entry_, calls, incl, excl in context.console.profiler.subroutines():
+        if entry_ == int(entry, 16):
+            assert calls == context.loops, f"{calls} calls of {entry}"
+            assert (incl, excl) == (inclusive * context.loops, exclusive * context.loops), (incl, excl)
+            return
+    assert False, f"No calls of {entry}"
+
+
+@when(u'a user turns tracing on with a temporary file')
+def step_impl(context):
+    context.trace_file = os.path.join(tempfile.mkdtemp(), "trace.gz")
+    context.execute_steps(f'When a user enters "trace on {context.trace_file}"')
+
+
+@then(u'the trace file holds "{n:d}" records')
+def step_impl(context, n):
+    records = list(tracer.read_trace(context.trace_file))
+    assert len(records) == n, f"Expected {n} records, got {len(records)}"
+
+
+@given(u'a file holding "{text}"')
+def step_impl(context, text):
+    context.input_file = os.path.join(tempfile.mkdtemp(), "input.txt")
+    with open(context.input_file, "w") as f:
+        f.write(text)
+
+
+@when(u'a user streams the file to the keyboard')
+def step_impl(context):
+    context.execute_steps(f'When a user enters "addinpt <{context.input_file}"')
+    assert context.command_run_result == "", context.command_run_result
+    context.execute_steps(u'When a user enters "showkbd"')
+    assert context.command_run_result.endswith(f"<{context.input_file}"), context.command_run_result
+
+
+@then(u'the keyboard gives "{text}" and then zeroes')
+@then(u'the keyboard gives "" and then zeroes')
+def step_impl(context, text=""):
+    kdb = context.console.kdb
+    got = bytes(kdb.read() for _ in range(len(text) + 2))
+    assert got == text.encode() + b"\0\0", got
+
+
+@when(u'a user runs "{k:d}" instructions "{n:d}" times')
+def step_impl(context, k, n):
+    context.runs = []
+    for _ in range(n):
+        context.execute_steps(f'When a user enters "run {k}"')
+        context.runs.append(context.command_run_result)
+
+
+@then(u'the CPU has counted "{total:d}" instructions and all cycles of the runs')
+def step_impl(context, total):
+    cycles = sum(int(run.split(", ")[1].split()[0]) for run in context.runs)
+    c = context.console.c
+    assert (c.instructions, c.cycles) == (total, cycles), (c.instructions, c.cycles, cycles)
+
+
+@when(u'Ctrl-C is pressed when address "{addr}" is read')
+def step_impl(context, addr):
+    mmu = context.console.c.mmu
+    def interrupt(addr, direction):
+        mmu.unwatch(addr, direction)
+        raise KeyboardInterrupt()
+    mmu.watch(int(addr, 16), "r", interrupt)
+
+
+@given(u'an observer subscribed to "{every}"')
+def step_impl(context, every):
+    context.notified = []
+    every = int(every) if every.isdigit() else every
+    context.console.c.subscribe(context.notified.append, every)
+
+
+@then(u'the observer is notified "{times}"')
+def step_impl(context, times):
+    c = context.console.c
+    expected = {"once per instruction": c.instructions, "once per run": len(context.runs),
+                "once per 100 cycles": c.cycles // 100}[times]
+    assert len(context.notified) == expected, f"{len(context.notified)} times, expected {expected}"
+
+
+@given(u'a script')
+def step_impl(context):
+    context.script = os.path.join(tempfile.mkdtemp(), "script.txt")
+    with open(context.script, "w") as f:
+        f.write(context.text + "\n")
+
+
+@when(u'a user runs the script')
+@when(u'a user runs the script "{modifiers}"')
+def step_impl(context, modifiers=""):
+    command = f"exefile {context.script} {modifiers}".rstrip()
+    context.execute_steps(f'When a user enters "{command}"')
+
+
+@given(u'output of long commands goes to a list')
+def step_impl(context):
+    context.output = []
+    context.console.output = context.output.append
+
+
+@then(u'the list holds "{first}", "{second}" and "{third}"')
+def step_impl(context, first, second, third):
+    assert context.output == [first, second, third], context.output
@@ -0,0 +1,107 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from behave import *
+
+from minicomp import headless
+
+
+@when(u'"{rom}" is run headless with input "{inpt}" for "{cycles:d}" cycles')
+@when(u'"{rom}" is run headless with input "" for "{cycles:d}" cycles')
+def step_impl(context, rom, cycles, inpt=""):
+    context.run_result, context.screen = headless.run_rom(rom, inpt.encode(), max_cycles=cycles)
+
+
+@then(u'the run stops because of "{reason}"')
+def step_impl(context, reason):
+    assert context.run_result.reason == reason, f"Run stopped with {context.run_result}"
+
+
+@then(u'the screen output is "{expected}"')
+@then(u'the screen output is ""')
+def step_impl(context, expected=""):
+    assert context.screen == expected.encode(), f"Screen got {context.screen}"
+
+
+@when(u'"python -m minicomp run" is started for "{rom}" with input "{inpt}" for "{cycles}" cycles')
+def step_impl(context, rom, inpt, cycles):
+    tmp = tempfile.mkdtemp()
+    context.screen_out = os.path.join(tmp, "screen.out")
+    with open(os.path.join(tmp, "input"), "w") as f:
+        f.write(inpt)
+    # -X importtime reports every imported module to stderr.
+    context.proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "minicomp", "run", os.path.abspath(rom),
+         "--input", os.path.join(tmp, "input"), "--cycles", cycles,
+         "--screen-out", context.screen_out],
+        cwd=os.path.dirname(os.getcwd()), capture_output=True, text=True)
+
+
+@then(u'it exits successfully and the screen file holds "{expected}"')
+def step_impl(context, expected):
+    assert context.proc.returncode == 0, context.proc.stderr
+    with open(context.screen_out) as f:
+        assert f.read() == expected
+
+
+@then(u'curses is not imported')
+def step_impl(context):
+    assert "curses" not in context.proc.stderr
+
+
+@given(u'a manifest with jobs running "{rom}" for "{cycles:d}" cycles')
+def step_impl(context, rom, cycles):
+    tmp = tempfile.mkdtemp()
+    context.manifest = os.path.join(tmp, "manifest")
+    with open(context.manifest, "w") as manifest:
+        for n, row in enumerate(context.table):
+            job = {"rom": os.path.abspath(rom), "cycles": cycles}
+            for key in ("input", "expected"):
+                job[key] = f"{key}{n}"
+                with open(os.path.join(tmp, job[key]), "w") as f:
+                    f.write(row[key])
+            manifest.write(json.dumps(job) + "\n")
+
+
+@when(u'the manifest is run in batch with "{workers:d}" workers')
+def step_impl(context, workers):
+    jobs = headless.read_manifest(context.manifest)
+    context.results = {r["line"]: r for r in headless.run_batch(jobs, workers)}
+
+
+@then(u'every job reports its stop reason and counts')
+def step_impl(context):
+    for result in context.results.values():
+        assert result["reason"] == "cycles", result
+        assert result["instructions"] > 0 and result["cycles"] >= 20000, result
+
+
+@then(u'jobs on lines "{passed}" pass and jobs on lines "{failed}" fail')
+def step_impl(context, passed, failed):
+    for lines, expected in ((passed, True), (failed, False)):
+        for line in lines.split(","):
+            result = context.results[int(line)]
+            assert result["passed"] is expected, result
+
+
+@given(u'a manifest with lines')
+def step_impl(context):
+    context.manifest = os.path.join(tempfile.mkdtemp(), "manifest")
+    with open(context.manifest, "w") as f:
+        f.write(context.text + "\n")
+
+
+@when(u'the manifest is read')
+def step_impl(context):
+    try:
+        context.jobs, context.error = list(headless.read_manifest(context.manifest)), None
+    except ValueError as e:
+        context.error = str(e)
+
+
+@then(u'reading fails with "{message}"')
+def step_impl(context, message):
+    assert context.error is not None and context.error.endswith(message), context.error
@@ -38,7 +38,7 @@ class PhonyStats:
     def reset(self):
         pass
 
-    def update_stats(self, cpu, refresh=False):
+    def update_stats(self, cpu):
         pass
 
 
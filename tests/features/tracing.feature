@@ -0,0 +1,29 @@
+Feature: executed instructions could be traced
+
+Background: console with a basic program exists
+	Given console is initiated
+
+
+Scenario: a user looks at the trace without turning tracing on
+	When a user enters "showtrace"
+	Then they get an error
+
+
+Scenario: a user looks at the latest traced instructions
+	When a user enters "trace on"
+	And  a user enters "step 20"
+	And  a user enters "showtrace 5"
+	Then they see the last "5" of "20" executed instructions
+
+
+Scenario: tracing does not change execution
+	When a user enters "trace on"
+	And  a user enters "step 1000"
+	Then PC is the same as after "1000" steps with the default engine
+
+
+Scenario: a trace streamed to a file holds every instruction
+	When a user turns tracing on with a temporary file
+	And  a user enters "step 70000"
+	And  a user enters "trace off"
+	Then the trace file holds "70000" records